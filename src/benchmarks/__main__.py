@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import json
+import sys
+
+import aioredis
+import asyncpg
+
+from .load import make_prefix
+from .load import run_load
+from .stack import Stack
+from ..workshop.constants import REFRESH_FAMILY_PREFIX
+from ..workshop.constants import SIGNIN_USERNAME_PREFIX
+from ..workshop.constants import USERNAMES_KEY
+
+
+# Нагрузочный прогон: python -m src.benchmarks --users 500 --concurrency 20
+# Результат - JSON с rps, p50 и p99 по сценариям (sign_up, sign_in, user,
+# emoticon_miss, emoticon_hit); его удобно сравнивать между коммитами.
+async def cleanup_postgres(env: dict, prefix: str) -> None:
+    connection = await asyncpg.connect(
+        host=env['PG_HOST'],
+        port=int(env['PG_PORT']),
+        user=env['PG_USER'],
+        password=env['PG_PASS'],
+        database=env['PG_DB_NAME'],
+    )
+    try:
+        await connection.execute('DELETE FROM users WHERE username LIKE $1',
+                                 prefix + '%')
+    finally:
+        await connection.close()
+
+
+async def cleanup_redis(url: str, prefix: str) -> None:
+    redis = aioredis.from_url(url)
+    try:
+        keys = [key async for key in redis.scan_iter(match=prefix + '*')]
+        keys += [key async for key in redis.scan_iter(
+            match=SIGNIN_USERNAME_PREFIX + prefix + '*',
+        )]
+        # семейства refresh-токенов названы случайно: пользователь
+        # записан внутри
+        async for key in redis.scan_iter(match=REFRESH_FAMILY_PREFIX + '*'):
+            username = await redis.hget(key, 'username')
+            if username is not None and username.decode().startswith(prefix):
+                keys.append(key)
+        if keys:
+            await redis.delete(*keys)
+
+        usernames = [name async for name in redis.sscan_iter(
+            USERNAMES_KEY, match=prefix + '*',
+        )]
+        if usernames:
+            await redis.srem(USERNAMES_KEY, *usernames)
+    finally:
+        await redis.close()
+
+
+async def cleanup(stack: Stack, prefix: str) -> None:
+    """Удаляет пользователей прогона из постоянных (не временных) баз."""
+    env = stack.env
+    if not stack.temporary_postgres:
+        await cleanup_postgres(env, prefix)
+    if not stack.temporary_redis:
+        urls = {env['REDIS_URL'], env['REDIS_STATE_URL']}
+        for url in urls:
+            await cleanup_redis(url, prefix)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--upstream-delay', type=float, default=0.02)
+    parser.add_argument('--external-services', action='store_true',
+                        help='использовать REDIS_URL и PG_* из окружения, '
+                             'даже если есть redis-server и initdb')
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    prefix = make_prefix()
+    with Stack(workers=args.workers,
+               upstream_delay=args.upstream_delay,
+               local_services=not args.external_services) as stack:
+        results = asyncio.run(
+            run_load(stack.base_url, prefix, args.users, args.concurrency),
+        )
+        asyncio.run(cleanup(stack, prefix))
+
+    report = json.dumps({
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'workers': args.workers,
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
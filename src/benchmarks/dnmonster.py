@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import struct
+import zlib
+
+from aiohttp import web
+
+
+# Заглушка amouat/dnmonster: на GET /monster/<name> отдает одну и ту же
+# PNG-картинку после задержки --delay (имитация времени генерации).
+def make_png(size: int) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(kind + data)
+        return b''.join((struct.pack('>I', len(data)), kind, data,
+                         struct.pack('>I', crc)))
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+    # строка: байт фильтра и size RGB-пикселей с градиентом
+    row = b'\x00' + bytes(i % 256 for i in range(size * 3))
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', header),
+        chunk(b'IDAT', zlib.compress(row * size)),
+        chunk(b'IEND', b''),
+    ))
+
+
+def create_app(delay: float, size: int) -> web.Application:
+    image = make_png(size)
+
+    async def monster(request: web.Request) -> web.Response:
+        if delay:
+            await asyncio.sleep(delay)
+        return web.Response(body=image, content_type='image/png')
+
+    app = web.Application()
+    app.router.add_get('/monster/{name}', monster)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Заглушка dnmonster')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--delay', type=float, default=0.02)
+    parser.add_argument('--size', type=int, default=100)
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.delay, args.size),
+                host='127.0.0.1',
+                port=args.port,
+                print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List
+
+from aiohttp import ClientSession
+from aiohttp import TCPConnector
+
+from .report import summarize
+
+
+PASSWORD = 'benchmark'
+
+
+async def scenario(items: List,
+                   request: Callable[..., Awaitable[bool]],
+                   concurrency: int) -> Dict[str, float]:
+    """Вызывает request для каждого элемента, не больше concurrency сразу.
+
+    request возвращает True при успешном ответе; неудачи и исключения
+    считаются ошибками и в задержки не попадают.
+    """
+    latencies: List[float] = []
+    errors = 0
+    queue = iter(items)
+
+    async def worker() -> None:
+        nonlocal errors
+        for item in queue:
+            started = time.perf_counter()
+            try:
+                ok = await request(item)
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def make_prefix() -> str:
+    # с номером пользователя имя не длиннее 20 символов (таблица users)
+    return f'b{uuid.uuid4().hex[:8]}'
+
+
+async def run_load(base_url: str,
+                   prefix: str,
+                   users: int,
+                   concurrency: int) -> Dict[str, dict]:
+    usernames = [f'{prefix}{i}' for i in range(users)]
+    tokens: Dict[str, str] = {}
+    results = {}
+
+    connector = TCPConnector(limit=concurrency)
+    async with ClientSession(base_url, connector=connector) as http:
+        async def sign_up(username: str) -> bool:
+            async with http.post('/auth/sign-up', json={
+                'username': username,
+                'password': PASSWORD,
+            }) as response:
+                if response.status != 200:
+                    return False
+                tokens[username] = (await response.json())['access_token']
+                return True
+
+        async def sign_in(username: str) -> bool:
+            async with http.post('/auth/sign-in', data={
+                'username': username,
+                'password': PASSWORD,
+            }) as response:
+                await response.read()
+                return response.status == 200
+
+        def auth(username: str) -> dict:
+            return {'Authorization': f'Bearer {tokens[username]}'}
+
+        async def user(username: str) -> bool:
+            async with http.get('/auth/user',
+                                headers=auth(username)) as response:
+                await response.read()
+                return response.status == 200
+
+        async def emoticon(username: str) -> bool:
+            async with http.get('/emoticon/',
+                                params={'username': username},
+                                headers=auth(username)) as response:
+                await response.read()
+                return response.status == 200
+
+        results['sign_up'] = await scenario(usernames, sign_up, concurrency)
+        registered = [name for name in usernames if name in tokens]
+        results['sign_in'] = await scenario(registered, sign_in,
+                                            concurrency)
+        results['user'] = await scenario(registered, user, concurrency)
+        # первый запрос эмотикона - промах (предгенерация выключена),
+        # второй - попадание в кэш
+        results['emoticon_miss'] = await scenario(registered, emoticon,
+                                                  concurrency)
+        results['emoticon_hit'] = await scenario(registered, emoticon,
+                                                 concurrency)
+    return results
@@ -0,0 +1,21 @@
+from typing import Dict, List
+
+
+def percentile(latencies: List[float], q: float) -> float:
+    if not latencies:
+        return 0.0
+    ordered = sorted(latencies)
+    index = min(len(ordered) - 1, int(len(ordered) * q))
+    return ordered[index]
+
+
+def summarize(latencies: List[float],
+              elapsed: float,
+              errors: int = 0) -> Dict[str, float]:
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
@@ -0,0 +1,161 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'{url} is not ready after {timeout}s')
+        time.sleep(0.2)
+
+
+class Stack:
+    """Приложение и локальные заменители его зависимостей.
+
+    - сервис эмотиконов: заглушка dnmonster (src/benchmarks/dnmonster.py);
+    - redis: временный redis-server (и для кэша, и для состояния входа),
+      если он есть в PATH, иначе REDIS_URL и REDIS_STATE_URL;
+    - postgres: временный кластер (initdb/pg_ctl), если они есть в PATH,
+      иначе база из PG_* переменных окружения.
+    Временные redis и postgres удаляются вместе с данными при остановке.
+    """
+
+    def __init__(self,
+                 workers: int = 1,
+                 upstream_delay: float = 0.02,
+                 local_services: bool = True):
+        self.workers = workers
+        self.upstream_delay = upstream_delay
+        self.local_services = local_services
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.env: Dict[str, str] = dict(os.environ)
+        self._processes: List[subprocess.Popen] = []
+        self._tmp: Optional[tempfile.TemporaryDirectory] = None
+        self._pg_data: Optional[str] = None
+        self.temporary_redis = False
+        self.temporary_postgres = False
+
+    def _spawn(self, args: List[str]) -> subprocess.Popen:
+        process = subprocess.Popen(args,
+                                   env=self.env,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        self._processes.append(process)
+        return process
+
+    def _start_redis(self) -> None:
+        port = free_port()
+        self._spawn(['redis-server', '--port', str(port),
+                     '--save', '', '--appendonly', 'no'])
+        # и состояние входа (refresh-токены, множество имен) - туда же,
+        # а не в REDIS_STATE_URL из окружения или .env
+        self.env['REDIS_URL'] = f'redis://127.0.0.1:{port}/0'
+        self.env['REDIS_STATE_URL'] = self.env['REDIS_URL']
+        self.temporary_redis = True
+
+    def _start_postgres(self) -> None:
+        port = free_port()
+        self._pg_data = os.path.join(self._tmp.name, 'pg')
+        subprocess.run(['initdb', '-D', self._pg_data, '-U', 'bench',
+                        '--auth=trust'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run(['pg_ctl', '-D', self._pg_data, '-w', '-o',
+                        f'-p {port} -k {self._tmp.name} '
+                        f'-c listen_addresses=127.0.0.1',
+                        'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        self.env.update({
+            'PG_HOST': '127.0.0.1',
+            'PG_PORT': str(port),
+            'PG_USER': 'bench',
+            'PG_PASS': 'bench',
+            'PG_DB_NAME': 'postgres',
+        })
+        self.temporary_postgres = True
+
+    def start(self, timeout: float = 60.0) -> 'Stack':
+        try:
+            self._start(timeout)
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def _start(self, timeout: float) -> None:
+        self._tmp = tempfile.TemporaryDirectory(prefix='workshop-bench-')
+        if self.local_services and shutil.which('redis-server'):
+            self._start_redis()
+        elif 'REDIS_URL' in self.env:
+            # без явного REDIS_STATE_URL приложение взяло бы его из .env,
+            # и ключи прогона остались бы в чужом redis
+            self.env.setdefault('REDIS_STATE_URL', self.env['REDIS_URL'])
+        if self.local_services and shutil.which('initdb'):
+            self._start_postgres()
+
+        stub_port = free_port()
+        self._spawn([sys.executable, '-m', 'src.benchmarks.dnmonster',
+                     '--port', str(stub_port),
+                     '--delay', str(self.upstream_delay)])
+        self.env.setdefault('JWT_SECRET', 'benchmark')
+        self.env.update({
+            'EMOTICON_SERVICE_URLS':
+                f'["http://127.0.0.1:{stub_port}/monster"]',
+            # иначе картинка создается при регистрации и промахов не будет
+            'EMOTICON_PREFETCH_ENABLED': 'false',
+            # все запросы идут с одного адреса и уперлись бы в лимит входов
+            'SIGNIN_RATE_LIMIT_ENABLED': 'false',
+        })
+        self._spawn([sys.executable, '-m', 'uvicorn',
+                     'src.workshop.app:app',
+                     '--host', '127.0.0.1',
+                     '--port', str(self.port),
+                     '--workers', str(self.workers),
+                     '--no-access-log'])
+        wait_for(f'{self.base_url}/readyz', timeout)
+
+    def stop(self) -> None:
+        for process in reversed(self._processes):
+            process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._processes = []
+
+        if self._pg_data is not None:
+            subprocess.run(['pg_ctl', '-D', self._pg_data, '-m', 'fast',
+                            'stop'],
+                           stdout=subprocess.DEVNULL)
+            self._pg_data = None
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+
+    def __enter__(self) -> 'Stack':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from .report import summarize
+from ..workshop import lifecycle
+from ..workshop.db import users as users_db
+from ..workshop.db.connection import database
+from ..workshop.db.User import User as DBUser
+
+
+# Сравнение поиска пользователя при входе: ormar против легкого слоя.
+# Нужна поднятая база (переменные окружения как у приложения):
+#   python -m src.benchmarks.user_lookup --iterations 5000 --concurrency 10
+BENCH_USERNAME = 'bench_lookup'
+BENCH_PASSWORD_HASH = 'x' * 60
+
+
+async def measure(lookup: Callable[[], Awaitable],
+                  iterations: int,
+                  concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+
+    async def worker(count: int) -> None:
+        for _ in range(count):
+            started = time.perf_counter()
+            await lookup()
+            latencies.append(time.perf_counter() - started)
+
+    per_worker = max(1, iterations // concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(per_worker) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return summarize(latencies, elapsed)
+
+
+async def ormar_lookup() -> None:
+    await DBUser.objects.get(username=BENCH_USERNAME)
+
+
+async def lean_lookup() -> None:
+    await users_db.get_credentials(BENCH_USERNAME)
+
+
+async def run(iterations: int, concurrency: int) -> Dict[str, dict]:
+    await lifecycle.connect_database()
+    await lifecycle.ensure_schema()
+    try:
+        await DBUser.objects.get_or_create(
+            username=BENCH_USERNAME,
+            password_hash=BENCH_PASSWORD_HASH,
+        )
+
+        results = {}
+        for name, lookup in (('ormar', ormar_lookup), ('lean', lean_lookup)):
+            # прогрев: соединения пула и подготовленные выражения
+            await measure(lookup, concurrency * 10, concurrency)
+            results[name] = await measure(lookup, iterations, concurrency)
+        return results
+    finally:
+        await DBUser.objects.filter(username=BENCH_USERNAME).delete()
+        await database.disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Поиск пользователя: ormar против легкого слоя")
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.iterations, args.concurrency))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
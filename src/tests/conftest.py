@@ -3,8 +3,10 @@ import pytest_asyncio
 
 from aioredis import Redis
 
+from ..workshop.cache.images import image_cache
 from ..workshop.db.connection import metadata, engine
 from ..workshop.settings import settings
+from ..workshop.upstream.breaker import emoticon_breaker
 
 
 @pytest_asyncio.fixture(autouse=True)
@@ -19,8 +21,19 @@ async def base():
         metadata.create_all(engine)
 
 
+@pytest_asyncio.fixture(autouse=True)
+async def upstream(monkeypatch):
+    # иначе каждая регистрация ставит в очередь запрос к недоступному
+    # сервису эмотиконов, и его ошибки размыкают общий breaker
+    monkeypatch.setattr(settings, 'emoticon_prefetch_enabled', False)
+    emoticon_breaker.reset()
+    yield
+    emoticon_breaker.reset()
+
+
 @pytest_asyncio.fixture
 async def redis() -> Redis:
     session: Redis = await aioredis.from_url(settings.redis_url)
     await session.flushall()
+    image_cache.clear()
     yield session
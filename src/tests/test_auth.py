@@ -2,6 +2,7 @@ import pytest
 import pytest_asyncio
 
 from fastapi.testclient import TestClient
+from mock import patch
 from jose import jwt
 from passlib.handlers.bcrypt import bcrypt
 from typing import List, Iterable
@@ -10,8 +11,14 @@ from ..workshop.app import app
 from ..workshop.settings import settings
 from ..workshop.db.User import User as DBUser
 from ..workshop.db.connection import database
+from ..workshop.cache.tokens import token_cache
+from ..workshop.services.auth import AuthService
+from ..workshop.services.hashing import password_hasher
+from ..workshop.services.ratelimit import sign_in_in_flight
 from ..workshop.constants import INCORRECT_USERNAME_OR_PASS_MESSAGE
 from ..workshop.constants import INCORRECT_TOKEN_MESSAGE
+from ..workshop.constants import SERVICE_BUSY_MESSAGE
+from ..workshop.constants import TOO_MANY_ATTEMPTS_MESSAGE
 
 
 def decode_token(token: str) -> dict:
@@ -185,3 +192,191 @@ async def test_auth_by_incorrect_token(user_data):
 
     assert res.status_code == 401
     assert res.json() == {'detail': INCORRECT_TOKEN_MESSAGE}
+
+
+@pytest.mark.asyncio
+async def test_sign_in_rejected_when_hasher_is_saturated(user_data,
+                                                         urlencoded_headers,
+                                                         monkeypatch):
+    await add_users_to_database((user_data,))
+    monkeypatch.setattr(settings, 'password_hash_queue_limit', 0)
+    login_data = generate_user_login_data(user_data)
+
+    with TestClient(app) as client:
+        res = client.post(url='/auth/sign-in',
+                          data=login_data,
+                          headers=urlencoded_headers)
+
+    assert res.status_code == 503
+    assert res.json() == {'detail': SERVICE_BUSY_MESSAGE}
+    assert res.headers['Retry-After'] == '1'
+
+
+@pytest.mark.asyncio
+async def test_sign_in_rate_limited_by_username(user_data,
+                                                urlencoded_headers,
+                                                redis,
+                                                monkeypatch):
+    await add_users_to_database((user_data,))
+    monkeypatch.setattr(settings, 'signin_username_limit', 1)
+    login_data = generate_user_login_data(user_data)
+
+    with TestClient(app) as client:
+        first = client.post(url='/auth/sign-in',
+                            data=login_data,
+                            headers=urlencoded_headers)
+        with patch('src.workshop.db.users.get_credentials') as mocked_db:
+            second = client.post(url='/auth/sign-in',
+                                 data=login_data,
+                                 headers=urlencoded_headers)
+
+    assert first.status_code == 200
+    assert second.status_code == 429
+    assert second.json() == {'detail': TOO_MANY_ATTEMPTS_MESSAGE}
+    assert 0 < int(second.headers['Retry-After']) <= 60
+    mocked_db.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_sign_in_rejected_when_too_many_in_flight(user_data,
+                                                        urlencoded_headers,
+                                                        monkeypatch):
+    await add_users_to_database((user_data,))
+    monkeypatch.setattr(sign_in_in_flight, 'in_flight',
+                        sign_in_in_flight.limit)
+    login_data = generate_user_login_data(user_data)
+
+    with TestClient(app) as client:
+        res = client.post(url='/auth/sign-in',
+                          data=login_data,
+                          headers=urlencoded_headers)
+
+    assert res.status_code == 503
+    assert res.json() == {'detail': SERVICE_BUSY_MESSAGE}
+    assert res.headers['Retry-After'] == '1'
+
+
+@pytest.mark.asyncio
+async def test_sign_in_with_unknown_username_skips_database(user_data,
+                                                            urlencoded_headers,
+                                                            redis):
+    await add_users_to_database((user_data,))
+    user_data['username'] += '_unknown'
+    login_data = generate_user_login_data(user_data)
+
+    with TestClient(app) as client:
+        with patch('src.workshop.db.users.get_credentials') as mocked_db:
+            res = client.post(url='/auth/sign-in',
+                              data=login_data,
+                              headers=urlencoded_headers)
+
+    assert res.status_code == 401
+    assert res.json() == {'detail': INCORRECT_USERNAME_OR_PASS_MESSAGE}
+    assert res.headers['server-timing'].startswith('total;dur=')
+    mocked_db.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_unknown_username_rejected_when_hasher_is_saturated(
+        user_data, urlencoded_headers, redis, monkeypatch):
+    await add_users_to_database((user_data,))
+    monkeypatch.setattr(settings, 'password_hash_queue_limit', 0)
+    monkeypatch.setattr(password_hasher, '_expected', 0.01)
+    user_data['username'] += '_unknown'
+    login_data = generate_user_login_data(user_data)
+
+    with TestClient(app) as client:
+        res = client.post(url='/auth/sign-in',
+                          data=login_data,
+                          headers=urlencoded_headers)
+
+    # как и для существующего имени
+    assert res.status_code == 503
+    assert res.json() == {'detail': SERVICE_BUSY_MESSAGE}
+
+
+@pytest.mark.asyncio
+async def test_sign_up_with_taken_username_skips_hashing(user_data, redis):
+    with TestClient(app) as client:
+        client.post('/auth/sign-up', json=user_data)
+        with patch('src.workshop.services.hashing.password_hasher.hash') \
+                as mocked_hash:
+            res = client.post('/auth/sign-up', json=user_data)
+
+    assert res.status_code == 422
+    mocked_hash.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_refresh_rotates_and_detects_reuse(user_data,
+                                                 urlencoded_headers,
+                                                 redis):
+    users = await add_users_to_database((user_data,))
+    login_data = generate_user_login_data(user_data)
+
+    with TestClient(app) as client:
+        signed_in = client.post(url='/auth/sign-in',
+                                data=login_data,
+                                headers=urlencoded_headers).json()
+        with patch('src.workshop.services.hashing.password_hasher'
+                   '.verify_and_update') as mocked_verify:
+            refreshed = client.post(url='/auth/refresh', json={
+                'refresh_token': signed_in['refresh_token'],
+            })
+        reused = client.post(url='/auth/refresh', json={
+            'refresh_token': signed_in['refresh_token'],
+        })
+        revoked = client.post(url='/auth/refresh', json={
+            'refresh_token': refreshed.json()['refresh_token'],
+        })
+
+    mocked_verify.assert_not_called()
+    assert refreshed.status_code == 200
+    assert refreshed.json()['refresh_token'] != signed_in['refresh_token']
+    assert validate_token(refreshed.json()['access_token'],
+                          users[0].username,
+                          users[0].id)
+    assert reused.status_code == 401
+    assert revoked.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_sign_in_upgrades_outdated_password_hash(user_data,
+                                                       urlencoded_headers):
+    await database.connect()
+    user = await DBUser.objects.create(
+        username=user_data['username'],
+        password_hash=bcrypt.using(rounds=4).hash(user_data['password']),
+    )
+    await database.disconnect()
+    login_data = generate_user_login_data(user_data)
+
+    with TestClient(app) as client:
+        res = client.post(url='/auth/sign-in',
+                          data=login_data,
+                          headers=urlencoded_headers)
+
+    await database.connect()
+    upgraded = await DBUser.objects.get(id=user.id)
+    await database.disconnect()
+
+    assert res.status_code == 200
+    assert bcrypt.from_string(upgraded.password_hash).rounds == \
+        settings.password_rounds['bcrypt']
+    assert bcrypt.verify(user_data['password'], upgraded.password_hash)
+
+
+@pytest.mark.asyncio
+async def test_validated_token_is_served_from_cache(user_data):
+    users = await add_users_to_database((user_data,))
+    token = AuthService.create_token(users[0]).access_token
+    token_cache.clear()
+
+    with patch('src.workshop.services.auth.jwt.decode',
+               wraps=jwt.decode) as mocked_decode:
+        first = AuthService.validate_token(token)
+        second = AuthService.validate_token(token)
+
+    mocked_decode.assert_called_once()
+    assert first == second
+    assert second.id == users[0].id
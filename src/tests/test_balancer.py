@@ -0,0 +1,144 @@
+import asyncio
+import itertools
+import time
+
+import pytest
+from aiohttp import ClientError
+from mock import AsyncMock, Mock, patch
+
+from ..workshop.services.emoticon import EmoticonService
+from ..workshop.upstream.balancer import Balancer
+from ..workshop.upstream.exceptions import UpstreamError
+
+
+class FakeResponse:
+    def __init__(self, status: int = 200):
+        self.status = status
+        self.released = 0
+
+    def release(self):
+        self.released += 1
+
+
+class FakeSession:
+    """Отвечает по URL реплики: задержка, затем ответ или ошибка."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.responses = []
+
+    async def get(self, url: str):
+        endpoint = url.rsplit('/', 1)[0]
+        delay, reply = self.replies[endpoint]
+        await asyncio.sleep(delay)
+        if isinstance(reply, Exception):
+            raise reply
+        response = FakeResponse(reply)
+        self.responses.append((endpoint, response))
+        return response
+
+
+def make_balancer(**kwargs) -> Balancer:
+    options = dict(
+        urls=['http://a', 'http://b'],
+        failure_threshold=2,
+        cooldown=0.05,
+        hedge_percentile=None,
+        hedge_min_samples=1,
+        latency_window=10,
+    )
+    options.update(kwargs)
+    return Balancer(**options)
+
+
+@pytest.mark.asyncio
+async def test_pick_prefers_fewest_outstanding():
+    balancer = make_balancer()
+    a, b = balancer.endpoints
+    a.outstanding = 3
+    b.outstanding = 1
+    assert balancer.pick() is b
+
+    b.outstanding = 5
+    assert balancer.pick() is a
+
+    session = FakeSession({'http://a': (0.05, 200), 'http://b': (0.05, 200)})
+    a.outstanding = b.outstanding = 0
+    request = asyncio.create_task(balancer.get(session, 'user', 1))
+    await asyncio.sleep(0.01)
+    assert a.outstanding + b.outstanding == 1
+
+    await request
+    assert a.outstanding == b.outstanding == 0
+
+
+def test_endpoint_is_down_after_failures_and_recovers():
+    balancer = make_balancer()
+    a, b = balancer.endpoints
+    b.outstanding = 10
+
+    balancer.record(a, False, 0)
+    assert balancer.pick() is a
+
+    balancer.record(a, False, 0)
+    assert not a.is_healthy(time.monotonic())
+    assert balancer.pick() is b
+
+    time.sleep(0.06)
+    assert a.is_healthy(time.monotonic())
+    assert balancer.pick() is a
+
+
+@pytest.mark.asyncio
+async def test_hedge_fires_after_delay_and_loser_is_released():
+    balancer = make_balancer(hedge_percentile=0.5)
+    balancer._latencies.extend([0.01, 0.01])
+    a, b = balancer.endpoints
+    session = FakeSession({'http://a': (0.2, 200), 'http://b': (0, 200)})
+
+    # первым выбирается a
+    with patch('src.workshop.upstream.balancer.random.random',
+               side_effect=itertools.cycle([0.0, 1.0])):
+        started = time.monotonic()
+        response = await balancer.get(session, 'user', 1)
+
+    assert time.monotonic() - started < 0.1
+    assert session.responses == [('http://b', response)]
+    await asyncio.sleep(0)
+    assert a.outstanding == b.outstanding == 0
+
+
+@pytest.mark.asyncio
+async def test_simultaneous_loser_is_released():
+    first, second = FakeResponse(), FakeResponse()
+
+    async def reply(response):
+        return response
+
+    tasks = [asyncio.create_task(reply(first)),
+             asyncio.create_task(reply(second))]
+    await asyncio.sleep(0)
+
+    response = await Balancer._first(tasks, time.monotonic() + 1)
+
+    loser = second if response is first else first
+    assert response.released == 0
+    assert loser.released == 1
+
+
+@pytest.mark.asyncio
+async def test_all_endpoints_failing_raise_upstream_error():
+    balancer = make_balancer(failure_threshold=10)
+    session = FakeSession({'http://a': (0, ClientError('a')),
+                           'http://b': (0, ClientError('b'))})
+
+    with pytest.raises(ClientError):
+        await balancer.get(session, 'user', 1)
+
+    service = EmoticonService(AsyncMock(), session)
+    with patch('src.workshop.services.emoticon.emoticon_balancer',
+               balancer), \
+            patch('src.workshop.services.emoticon.emoticon_breaker',
+                  Mock()):
+        with pytest.raises(UpstreamError):
+            await service.open_upstream('user', time.monotonic() + 1)
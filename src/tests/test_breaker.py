@@ -0,0 +1,80 @@
+import time
+
+from ..workshop.upstream.breaker import CircuitBreaker
+
+
+def make_breaker(reset_timeout: float = 0.05,
+                 half_open_max_calls: int = 1) -> CircuitBreaker:
+    return CircuitBreaker(name='test',
+                          failure_threshold=2,
+                          reset_timeout=reset_timeout,
+                          half_open_max_calls=half_open_max_calls)
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures():
+    breaker = make_breaker()
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_half_open_probe_success_closes():
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_half_open_probe_failure_reopens():
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_half_open_limits_probes():
+    breaker = make_breaker(half_open_max_calls=2)
+    open_breaker(breaker)
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # пробы так и не завершились: через reset_timeout пускаем новые
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_reset_closes():
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    breaker.reset()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
@@ -0,0 +1,75 @@
+import csv
+import io
+
+import pytest
+from passlib.handlers.bcrypt import bcrypt
+
+from ..workshop.bulk import check_row
+from ..workshop.bulk import run_export
+from ..workshop.bulk import run_import
+from ..workshop.db.User import User as DBUser
+from ..workshop.db.connection import database
+
+
+CSV_DATA = ('username,password\n'
+            'alice,pw12\n'
+            'bob,pw34\n'
+            'alice,pw56\n'
+            'carol,x\n')
+JSONL_DATA = ('{"username": 12345, "password": "abcd"}\n'
+              '{"username": "dave", "password": 123456}\n'
+              '{"username": "erin", "password": "pw78"}\n')
+
+
+@pytest.mark.asyncio
+async def test_import_skips_duplicates_and_invalid_rows(redis):
+    result = await run_import(io.StringIO(CSV_DATA), 'csv',
+                              batch_size=2, workers=1,
+                              update_existing=False)
+
+    await database.connect()
+    users = {user.username: user
+             for user in await DBUser.objects.all()}
+    await database.disconnect()
+
+    assert result['read'] == 4
+    assert result['inserted'] == 2
+    assert result['duplicates'] == 1
+    assert result['invalid'] == 1
+    assert set(users) == {'alice', 'bob'}
+    assert bcrypt.verify('pw12', users['alice'].password_hash)
+
+
+@pytest.mark.asyncio
+async def test_export_streams_imported_users(redis):
+    await run_import(io.StringIO(CSV_DATA), 'csv',
+                     batch_size=2, workers=1, update_existing=False)
+    output = io.StringIO()
+
+    result = await run_export(output, 'csv', batch_size=1)
+
+    output.seek(0)
+    rows = list(csv.DictReader(output))
+    assert result['exported'] == 2
+    assert [row['username'] for row in rows] == ['alice', 'bob']
+    assert all(row['password_hash'].startswith('$2b$') for row in rows)
+
+
+def test_non_string_fields_are_invalid():
+    assert check_row({'username': 12345, 'password': 'abcd'}) == \
+        'bad username'
+    assert check_row({'username': 'dave', 'password': 123456}) == \
+        'password must be a string'
+    assert check_row({'username': 'dave', 'password_hash': ['x']}) == \
+        'password_hash must be a string'
+
+
+@pytest.mark.asyncio
+async def test_import_counts_non_string_rows_as_invalid(redis):
+    result = await run_import(io.StringIO(JSONL_DATA), 'jsonl',
+                              batch_size=2, workers=1,
+                              update_existing=False)
+
+    assert result['read'] == 3
+    assert result['invalid'] == 2
+    assert result['inserted'] == 1
@@ -1,14 +1,29 @@
+import asyncio
+import base64
 import random
 import pytest
 
+from aiohttp import ClientError
 from asynctest import patch as async_patch, CoroutineMock
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from mock import Mock
+from mock import AsyncMock, Mock, patch
 from aioredis import Redis
+from aioredis.exceptions import ConnectionError as RedisConnectionError
 
 from ..workshop.app import app
 from ..workshop.models.auth import UserCreate
+from ..workshop.settings import settings
+from ..workshop.services.emoticon import EmoticonService
+from ..workshop.cache.images import CachedImage
+from ..workshop.cache.images import image_cache
+from ..workshop.upstream.exceptions import UpstreamError
 from ..workshop.constants import EMOTICON_POSTFIX
+from ..workshop.constants import EMOTICON_ETAG_POSTFIX
+from ..workshop.constants import EMOTICON_LOCK_POSTFIX
+from ..workshop.constants import EMOTICON_FORBIDDEN
+from ..workshop.constants import EMOTICON_NOT_FOUND
+from ..workshop.constants import EMOTICON_ERROR_POSTFIX
 from ..workshop.constants import UNAUTHORIZED_MESSAGE
 
 
@@ -17,15 +32,25 @@ emoticons = {
 }
 
 
+def emoticon_response_mock(emoticon: bytes) -> Mock:
+    async def iter_chunked(size: int):
+        for i in range(0, len(emoticon), size):
+            yield emoticon[i:i + size]
+
+    res = Mock()
+    res.read = CoroutineMock(return_value=emoticon)
+    res.content.iter_chunked = iter_chunked
+    res.content_length = len(emoticon)
+    res.status = 200
+    return res
+
+
 def side_effect_emoticon(url):
     values = {f'http://emoticon:8080/monster/{key}': emoticons[key]
               for key in emoticons.keys()}
 
     if values.get(url):
-        res = Mock()
-        res.read = CoroutineMock(return_value=values.get(url))
-        res.status = 200
-        return res
+        return emoticon_response_mock(values.get(url))
     raise RuntimeError('Incorrect url')
 
 
@@ -108,3 +133,322 @@ async def test_get_emoticon_from_cache(user_data: UserCreate, redis: Redis):
     assert response_data == user_emoticon
     assert response.status_code == 200
     assert await redis.get(username + EMOTICON_POSTFIX) == user_emoticon
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced(user_data: UserCreate,
+                                               redis: Redis):
+    username = user_data.username
+    user_emoticon = emoticons[username]
+
+    async def slow_get(url: str) -> Mock:
+        await asyncio.sleep(0.1)
+        return side_effect_emoticon(url)
+
+    http = Mock()
+    http.get = CoroutineMock(side_effect=slow_get)
+    services = [EmoticonService(redis, http) for _ in range(5)]
+    responses = await asyncio.gather(
+        *(service.get_user_emoticon(username) for service in services)
+    )
+    await asyncio.gather(*EmoticonService._tasks)
+
+    http.get.assert_called_once()
+    assert len(responses) == 5
+    assert all(response.status_code == 200 for response in responses)
+    assert await redis.get(username + EMOTICON_POSTFIX) == user_emoticon
+
+
+@pytest.mark.asyncio
+async def test_get_emoticon_from_memory_cache(user_data: UserCreate,
+                                              redis: Redis):
+    username = user_data.username
+    user_emoticon = emoticons[username]
+    await redis.set(username + EMOTICON_POSTFIX, user_emoticon)
+
+    with TestClient(app) as client:
+        response = client.post('/auth/sign-up', json=user_data.dict())
+        access_token = response.json()['access_token']
+        login_headers = {'Authorization': f'Bearer {access_token}'}
+
+        client.get(url='/emoticon/',
+                   headers=login_headers,
+                   params={'username': username})
+
+        with async_patch("aioredis.Redis.get", new=CoroutineMock()) \
+                as mocked_redis_get:
+            response = client.get(url='/emoticon/',
+                                  headers=login_headers,
+                                  params={'username': username})
+
+    mocked_redis_get.assert_not_called()
+    assert response.status_code == 200
+    assert response.content == user_emoticon
+
+
+@pytest.mark.asyncio
+async def test_get_emoticon_not_modified(user_data: UserCreate, redis: Redis):
+    username = user_data.username
+    user_emoticon = emoticons[username]
+    await redis.set(username + EMOTICON_POSTFIX, user_emoticon)
+
+    with TestClient(app) as client:
+        response = client.post('/auth/sign-up', json=user_data.dict())
+        access_token = response.json()['access_token']
+        login_headers = {'Authorization': f'Bearer {access_token}'}
+
+        response = client.get(url='/emoticon/',
+                              headers=login_headers,
+                              params={'username': username})
+        etag = response.headers['ETag']
+
+        image_cache.clear()
+        response = client.get(url='/emoticon/',
+                              headers={**login_headers,
+                                       'If-None-Match': etag},
+                              params={'username': username})
+
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['ETag'] == etag
+    assert 'max-age' in response.headers['Cache-Control']
+    assert response.headers['Cache-Control'].startswith('private')
+    assert await redis.get(username + EMOTICON_ETAG_POSTFIX) == etag.encode()
+
+
+@pytest.mark.asyncio
+async def test_get_emoticon_batch(user_data: UserCreate, redis: Redis):
+    username = user_data.username
+    user_emoticon = emoticons[username]
+
+    with async_patch("aiohttp.ClientSession.get", new=CoroutineMock()) as mocked_get:   # noqa
+        set_emoticon_response_mock(mocked_get, 200)
+
+        with TestClient(app) as client:
+            response = client.post('/auth/sign-up', json=user_data.dict())
+            access_token = response.json()['access_token']
+            login_headers = {'Authorization': f'Bearer {access_token}'}
+
+            response = client.post(url='/emoticon/batch',
+                                   headers=login_headers,
+                                   json={'usernames': [username, 'other']})
+            response_data = response.json()
+
+    assert response.status_code == 200
+    assert base64.b64decode(response_data['images'][username]) == \
+        user_emoticon
+    assert response_data['images']['other'] is None
+    assert response_data['errors'] == {'other': EMOTICON_FORBIDDEN}
+    assert await redis.get(username + EMOTICON_POSTFIX) == user_emoticon
+
+
+@pytest.mark.asyncio
+async def test_batch_does_not_fetch_unknown_usernames(user_data: UserCreate,
+                                                      redis: Redis,
+                                                      monkeypatch):
+    monkeypatch.setattr(settings, 'emoticon_batch_policy', 'any')
+
+    with async_patch("aiohttp.ClientSession.get", new=CoroutineMock()) as mocked_get:   # noqa
+        set_emoticon_response_mock(mocked_get, 200)
+
+        with TestClient(app) as client:
+            response = client.post('/auth/sign-up', json=user_data.dict())
+            access_token = response.json()['access_token']
+            login_headers = {'Authorization': f'Bearer {access_token}'}
+
+            response = client.post(url='/emoticon/batch',
+                                   headers=login_headers,
+                                   json={'usernames': ['nobody']})
+
+    assert response.status_code == 200
+    assert response.json()['errors'] == {'nobody': EMOTICON_NOT_FOUND}
+    assert all('nobody' not in str(call)
+               for call in mocked_get.call_args_list)
+    assert await redis.get('nobody' + EMOTICON_POSTFIX) is None
+
+
+@pytest.mark.asyncio
+async def test_emoticon_is_pregenerated_on_sign_up(user_data: UserCreate,
+                                                   redis: Redis,
+                                                   monkeypatch):
+    monkeypatch.setattr(settings, 'emoticon_prefetch_enabled', True)
+    username = user_data.username
+    user_emoticon = emoticons[username]
+
+    with async_patch("aiohttp.ClientSession.get", new=CoroutineMock()) as mocked_get:   # noqa
+        set_emoticon_response_mock(mocked_get, 200)
+
+        with TestClient(app) as client:
+            client.post('/auth/sign-up', json=user_data.dict())
+
+            for _ in range(50):
+                if await redis.get(username + EMOTICON_POSTFIX):
+                    break
+                await asyncio.sleep(0.02)
+
+    mocked_get.assert_called_once()
+    assert await redis.get(username + EMOTICON_POSTFIX) == user_emoticon
+
+
+@pytest.mark.asyncio
+async def test_stale_emoticon_is_refreshed_in_background(user_data: UserCreate,
+                                                         redis: Redis):
+    username = user_data.username
+    user_emoticon = emoticons[username]
+    stale_emoticon = b'\x89PNG stale'
+    # оставшийся TTL меньше hard_ttl - soft_ttl: картинка устарела
+    ttl = settings.emoticon_hard_ttl - settings.emoticon_soft_ttl - 60
+    await redis.set(username + EMOTICON_POSTFIX, stale_emoticon, ex=ttl)
+
+    with async_patch("aiohttp.ClientSession.get", new=CoroutineMock()) as mocked_get:   # noqa
+        set_emoticon_response_mock(mocked_get, 200)
+
+        with TestClient(app) as client:
+            response = client.post('/auth/sign-up', json=user_data.dict())
+            access_token = response.json()['access_token']
+            login_headers = {'Authorization': f'Bearer {access_token}'}
+
+            response = client.get(url='/emoticon/',
+                                  headers=login_headers,
+                                  params={'username': username})
+
+            for _ in range(50):
+                if await redis.get(username + EMOTICON_POSTFIX) == \
+                        user_emoticon:
+                    break
+                await asyncio.sleep(0.02)
+
+    assert response.status_code == 200
+    assert response.content == stale_emoticon
+    assert await redis.get(username + EMOTICON_POSTFIX) == user_emoticon
+    assert await redis.ttl(username + EMOTICON_POSTFIX) > \
+        settings.emoticon_hard_ttl - 60
+
+
+@pytest.mark.asyncio
+async def test_get_emoticon_upstream_error_is_not_cached(user_data: UserCreate,
+                                                         redis: Redis):
+    username = user_data.username
+    error_response = emoticon_response_mock(b'<html>Bad Gateway</html>')
+    error_response.status = 502
+
+    with async_patch("aiohttp.ClientSession.get", new=CoroutineMock()) as mocked_get:   # noqa
+        mocked_get.return_value = error_response
+
+        with TestClient(app) as client:
+            response = client.post('/auth/sign-up', json=user_data.dict())
+            access_token = response.json()['access_token']
+            login_headers = {'Authorization': f'Bearer {access_token}'}
+
+            response = client.get(url='/emoticon/',
+                                  headers=login_headers,
+                                  params={'username': username})
+
+    assert response.status_code == 423
+    assert await redis.get(username + EMOTICON_POSTFIX) is None
+    assert await redis.exists(username + EMOTICON_ERROR_POSTFIX)
+
+
+async def hang(*args) -> bytes:
+    await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch_fetch_releases_waiters(redis: Redis):
+    service = EmoticonService(redis, Mock())
+
+    with patch.object(EmoticonService, 'generate_emoticon', new=hang):
+        task = asyncio.create_task(service.fetch_emoticons(['first',
+                                                            'second']))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert not service._flight.in_flight('first')
+    assert not service._flight.in_flight('second')
+
+
+@pytest.mark.asyncio
+async def test_batch_fetch_waits_for_other_worker(redis: Redis):
+    username = 'remote'
+    image = emoticons['oehosa']
+    # картинку уже загружает другой воркер
+    await redis.set(username + EMOTICON_LOCK_POSTFIX, 'other-worker')
+    service = EmoticonService(redis, Mock())
+
+    async def other_worker():
+        await asyncio.sleep(0.1)
+        await service.save_image_to_redis(image, username)
+        await redis.delete(username + EMOTICON_LOCK_POSTFIX)
+
+    with patch.object(EmoticonService, 'generate_emoticon') as generate:
+        saved, _ = await asyncio.gather(service.fetch_emoticons([username]),
+                                        other_worker())
+
+    generate.assert_not_called()
+    assert saved[username].image == image
+
+
+@pytest.mark.asyncio
+async def test_batch_fetch_releases_own_locks(redis: Redis):
+    image = emoticons['oehosa']
+    service = EmoticonService(redis, Mock())
+
+    with patch.object(EmoticonService, 'generate_emoticon',
+                      new=AsyncMock(return_value=image)):
+        saved = await service.fetch_emoticons(['own'])
+
+    assert saved['own'].image == image
+    assert not await redis.exists('own' + EMOTICON_LOCK_POSTFIX)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_stream_releases_waiters(redis: Redis):
+    service = EmoticonService(redis, Mock())
+    future = service._flight.lead('streamed')
+    queue = asyncio.Queue()
+
+    async def chunks():
+        yield await hang()
+
+    task = asyncio.create_task(service._tee('streamed', Mock(), b'head',
+                                            chunks(), None, future, queue))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert future.cancelled()
+    assert not service._flight.in_flight('streamed')
+    assert queue.get_nowait() == b'head'
+    assert isinstance(queue.get_nowait(), UpstreamError)
+
+
+@pytest.mark.asyncio
+async def test_waiter_gets_423_when_leader_fails_mid_stream(redis: Redis):
+    service = EmoticonService(redis, Mock())
+    future = service._flight.lead('joined')
+
+    waiter = asyncio.create_task(service.get_user_emoticon('joined'))
+    await asyncio.sleep(0.05)
+    service._flight.reject('joined', future, ClientError('reset'))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await waiter
+    assert exc_info.value.status_code == 423
+
+
+@pytest.mark.asyncio
+async def test_not_modified_from_stale_copy_when_redis_is_down(monkeypatch):
+    username = 'offline'
+    etag = '"offline-etag"'
+    image_cache.put(username, CachedImage(emoticons['oehosa'], etag))
+    # свежесть L1 истекла, устаревшую копию еще можно отдать
+    monkeypatch.setattr(image_cache, 'ttl', 0)
+    redis = AsyncMock()
+    redis.get.side_effect = RedisConnectionError()
+    service = EmoticonService(redis, Mock())
+
+    response = await service.get_user_emoticon(username, etag)
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
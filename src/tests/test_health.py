@@ -0,0 +1,30 @@
+from fastapi.testclient import TestClient
+
+from ..workshop.app import app
+
+
+def test_healthz():
+    with TestClient(app) as client:
+        res = client.get('/healthz')
+
+    assert res.status_code == 200
+    assert res.json() == {'status': 'ok'}
+
+
+def test_readyz_after_startup():
+    with TestClient(app) as client:
+        res = client.get('/readyz')
+
+    assert res.status_code == 200
+    assert res.json() == {
+        'status': 'ready',
+        'checks': {'startup': 'ok', 'database': 'ok', 'redis': 'ok'},
+    }
+
+
+def test_readyz_before_startup():
+    client = TestClient(app)
+    res = client.get('/readyz')
+
+    assert res.status_code == 503
+    assert res.json()['status'] == 'not ready'
@@ -0,0 +1,43 @@
+from contextlib import asynccontextmanager
+
+import pytest
+from mock import AsyncMock, Mock, patch
+
+from ..workshop import lifecycle
+from ..workshop.db.User import User
+
+
+def fake_connection(exists: bool) -> Mock:
+    connection = Mock()
+    connection.raw_connection.execute = AsyncMock()
+    connection.raw_connection.fetchval = AsyncMock(return_value=exists)
+    return connection
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('exists', [False, True])
+async def test_schema_is_created_under_advisory_lock(exists):
+    connection = fake_connection(exists)
+    calls = connection.raw_connection.execute.call_args_list
+    created = []
+
+    def create_all(engine):
+        # DDL идет, пока блокировка удерживается
+        created.append([call.args[0] for call in calls])
+
+    @asynccontextmanager
+    async def connect():
+        yield connection
+
+    with patch.object(lifecycle.database, 'connection', connect), \
+            patch.object(lifecycle.metadata, 'create_all', create_all):
+        await lifecycle.ensure_schema()
+
+    statements = [call.args[0] for call in calls]
+    assert statements == ['SELECT pg_advisory_lock($1)',
+                          'SELECT pg_advisory_unlock($1)']
+    assert User.Meta.tablename in lifecycle.metadata.tables
+    if exists:
+        assert created == []
+    else:
+        assert created == [['SELECT pg_advisory_lock($1)']]
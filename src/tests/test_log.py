@@ -0,0 +1,59 @@
+import io
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueListener
+
+from prometheus_client import REGISTRY
+
+from ..workshop.log import DroppingQueueHandler
+from ..workshop.log import JsonFormatter
+from ..workshop.log import SamplingFilter
+
+
+def make_record(name: str, level: int, exc_info=None) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 0, 'message', None,
+                             exc_info)
+
+
+def test_sampling_keeps_warnings_and_other_loggers():
+    sampling = SamplingFilter(0, ['main.auth_service'])
+
+    assert not sampling.filter(make_record('main.auth_service',
+                                           logging.INFO))
+    assert sampling.filter(make_record('main.auth_service',
+                                       logging.WARNING))
+    assert sampling.filter(make_record('main.lifecycle', logging.INFO))
+
+
+def test_full_queue_drops_records():
+    dropped = REGISTRY.get_sample_value('log_records_dropped_total')
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    handler.handle(make_record('main', logging.INFO))
+    handler.handle(make_record('main', logging.INFO))
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+    assert REGISTRY.get_sample_value('log_records_dropped_total') == \
+        dropped + 1
+
+
+def test_json_keeps_exception_in_separate_field():
+    output = io.StringIO()
+    stream_handler = logging.StreamHandler(output)
+    stream_handler.setFormatter(JsonFormatter())
+    handler = DroppingQueueHandler(queue.Queue())
+    listener = QueueListener(handler.queue, stream_handler)
+
+    try:
+        raise ValueError('broken')
+    except ValueError:
+        record = make_record('main', logging.ERROR, sys.exc_info())
+    listener.start()
+    handler.handle(record)
+    listener.stop()
+
+    data = json.loads(output.getvalue())
+    assert data['message'] == 'message'
+    assert 'ValueError: broken' in data['exc_info']
@@ -0,0 +1,17 @@
+from fastapi.testclient import TestClient
+
+from ..workshop.app import app
+
+
+def test_metrics_by_route_template():
+    client = TestClient(app)
+    client.get('/emoticon/', params={'username': 'someone'})
+    res = client.get('/metrics')
+
+    assert res.status_code == 200
+    assert res.headers['content-type'].startswith('text/plain')
+    assert ('http_requests_total{method="GET",route="/emoticon/",'
+            'status="401"}') in res.text
+    assert ('http_request_seconds_count{method="GET",route="/emoticon/"}'
+            in res.text)
+    assert 'db_pool_connections{state="max"}' in res.text
@@ -0,0 +1,43 @@
+import pathlib
+import re
+
+import pytest
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+
+NGINX_CONF = pathlib.Path(__file__).parents[2].joinpath(
+    'docker', 'nginx', 'conf.d', 'nginx.conf',
+)
+NGINX_VARIABLES = {
+    '$remote_addr': lambda forged, remote: remote,
+    '$proxy_add_x_forwarded_for': lambda forged, remote: f'{forged}, {remote}',
+}
+
+
+def nginx_forwarded_for(forged: str, remote: str) -> str:
+    """X-Forwarded-For, который nginx передаст приложению."""
+    values = re.findall(r'proxy_set_header\s+X-Forwarded-For\s+(\S+);',
+                        NGINX_CONF.read_text())
+    assert len(values) == 1
+    return NGINX_VARIABLES[values[0]](forged, remote)
+
+
+@pytest.mark.asyncio
+async def test_forged_forwarded_for_through_nginx_is_ignored():
+    seen = {}
+
+    async def app(scope, receive, send):
+        seen['client'] = scope['client']
+
+    # как в docker-compose.yml: SERVER_FORWARDED_ALLOW_IPS=*
+    middleware = ProxyHeadersMiddleware(app, trusted_hosts='*')
+    header = nginx_forwarded_for(forged='1.2.3.4', remote='203.0.113.9')
+    scope = {
+        'type': 'http',
+        'client': ('172.18.0.5', 40000),   # nginx
+        'headers': [(b'x-forwarded-for', header.encode())],
+    }
+
+    await middleware(scope, None, None)
+
+    assert seen['client'][0] == '203.0.113.9'
@@ -0,0 +1,39 @@
+import inspect
+
+import pytest
+from mock import AsyncMock
+
+from ..workshop.redis.connection import get_state_session
+from ..workshop.redis.memory import redis_memory_monitor
+from ..workshop.services.auth import AuthService
+from ..workshop.settings import settings
+
+
+@pytest.mark.asyncio
+async def test_eviction_is_not_enabled_next_to_session_state(monkeypatch):
+    monkeypatch.setattr(settings, 'redis_max_memory', '64mb')
+    monkeypatch.setattr(settings, 'redis_state_url', None)
+    redis = AsyncMock()
+
+    await redis_memory_monitor.configure(redis)
+
+    redis.config_set.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_eviction_is_enabled_with_separate_state_redis(monkeypatch):
+    monkeypatch.setattr(settings, 'redis_max_memory', '64mb')
+    monkeypatch.setattr(settings, 'redis_state_url', 'redis://state:6379/0')
+    redis = AsyncMock()
+
+    await redis_memory_monitor.configure(redis)
+
+    redis.config_set.assert_any_call('maxmemory', '64mb')
+    redis.config_set.assert_any_call('maxmemory-policy',
+                                     settings.redis_max_memory_policy)
+
+
+def test_sign_in_state_uses_non_evicting_redis():
+    # refresh-токены, лимиты входа и множество имен идут через AuthService
+    redis = inspect.signature(AuthService).parameters['redis'].default
+    assert redis.dependency is get_state_session
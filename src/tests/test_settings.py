@@ -0,0 +1,17 @@
+from ..workshop.settings import settings
+
+
+def test_default_workers_are_bounded(monkeypatch):
+    monkeypatch.setattr(settings, 'server_workers', 0)
+    monkeypatch.setattr('os.cpu_count', lambda: 64)
+
+    assert settings.workers == settings.server_max_workers
+
+
+def test_pg_pools_fit_connection_budget(monkeypatch):
+    monkeypatch.setattr(settings, 'server_workers', 8)
+    monkeypatch.setattr(settings, 'pg_pool_max_size', None)
+    monkeypatch.setattr(settings, 'pg_max_connections', 80)
+
+    assert settings.pg_pool_size == 10
+    assert settings.workers * settings.pg_pool_size <= 80
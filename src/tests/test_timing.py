@@ -0,0 +1,28 @@
+from fastapi.testclient import TestClient
+
+from ..workshop.app import app
+from ..workshop.timing import server_timing
+from ..workshop.timing import span
+from ..workshop.timing import start_request
+
+
+def test_server_timing_header():
+    client = TestClient(app)
+    res = client.get('/healthz')
+
+    assert res.status_code == 200
+    assert res.headers['server-timing'].startswith('total;dur=')
+
+
+def test_spans_are_summed():
+    spans = start_request()
+    with span('redis'):
+        pass
+    with span('redis'):
+        pass
+    with span('bcrypt'):
+        pass
+
+    assert list(spans) == ['redis', 'bcrypt']
+    header = server_timing({'redis': 0.0015}, 0.01)
+    assert header == 'redis;dur=1.50, total;dur=10.00'
@@ -0,0 +1,62 @@
+import pytest
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+from mock import AsyncMock, patch
+
+from ..workshop.constants import RELEASE_LOCK_SCRIPT
+from ..workshop.constants import USERNAMES_BUILD_KEY
+from ..workshop.constants import USERNAMES_KEY
+from ..workshop.constants import USERNAMES_LOCK_KEY
+from ..workshop.services.usernames import ADD_CHUNK_SIZE
+from ..workshop.services.usernames import UsernameFilter
+
+
+@pytest.mark.asyncio
+async def test_failed_add_drops_filter_for_all_workers():
+    username_filter = UsernameFilter()
+    redis = AsyncMock()
+    redis.evalsha.side_effect = RedisConnectionError()
+
+    assert not await username_filter.add(redis, 'alice')
+
+    redis.delete.assert_called_once_with(USERNAMES_KEY, USERNAMES_BUILD_KEY)
+    assert not username_filter._stale
+
+
+@pytest.mark.asyncio
+async def test_filter_is_stale_locally_until_dropped():
+    username_filter = UsernameFilter()
+    redis = AsyncMock()
+    redis.evalsha.side_effect = RedisConnectionError()
+    redis.delete.side_effect = RedisConnectionError()
+
+    assert not await username_filter.add(redis, 'alice')
+
+    assert username_filter._stale
+
+
+@pytest.mark.asyncio
+async def test_rebuild_releases_only_own_lock():
+    username_filter = UsernameFilter()
+    redis = AsyncMock()
+    redis.set.return_value = True
+
+    with patch.object(username_filter, '_build', AsyncMock()):
+        assert await username_filter.rebuild(redis)
+
+    token = redis.set.call_args.args[1]
+    redis.eval.assert_called_once_with(RELEASE_LOCK_SCRIPT, 1,
+                                       USERNAMES_LOCK_KEY, token)
+    redis.delete.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_large_add_is_split_into_chunks():
+    username_filter = UsernameFilter()
+    redis = AsyncMock()
+    usernames = [f'user{number}' for number in range(ADD_CHUNK_SIZE + 1)]
+
+    assert await username_filter.add(redis, *usernames)
+
+    chunks = [call.args[4:] for call in redis.evalsha.call_args_list]
+    assert [len(chunk) for chunk in chunks] == [ADD_CHUNK_SIZE, 1]
+    assert [name for chunk in chunks for name in chunk] == usernames
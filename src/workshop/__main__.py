@@ -1,11 +1,53 @@
+import glob
+import os
+
 import uvicorn
 
 from src.workshop.settings import settings
 
 
-uvicorn.run(
-    'src.workshop.app:app',
-    host=settings.server_host,
-    port=settings.server_port,
-    reload=True,
-)
+APP = 'src.workshop.app:app'
+
+
+def clear_metrics_dir() -> None:
+    # файлы метрик прошлого запуска исказили бы счетчики новых воркеров
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not path:
+        return
+    os.makedirs(path, exist_ok=True)
+    for file in glob.glob(os.path.join(path, '*.db')):
+        os.remove(file)
+
+
+def main() -> None:
+    clear_metrics_dir()
+
+    if settings.server_reload:
+        # режим разработки: один процесс, перезапуск при изменении файлов
+        uvicorn.run(
+            APP,
+            host=settings.server_host,
+            port=settings.server_port,
+            reload=True,
+        )
+        return
+
+    uvicorn.run(
+        APP,
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=settings.workers,
+        loop=settings.server_loop,
+        http=settings.server_http,
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keepalive_timeout,
+        limit_max_requests=settings.server_limit_max_requests,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.server_forwarded_allow_ips,
+    )
+
+
+# воркеры uvicorn запускаются через spawn и заново импортируют этот модуль
+if __name__ == '__main__':
+    main()
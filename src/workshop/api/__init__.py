@@ -2,8 +2,12 @@ from fastapi import APIRouter
 
 from ..api.auth import router as auth_router
 from ..api.emoticon import router as emoticon_router
+from ..api.health import router as health_router
+from ..api.metrics import router as metrics_router
 
 
 router = APIRouter()
 router.include_router(auth_router)
 router.include_router(emoticon_router)
+router.include_router(health_router)
+router.include_router(metrics_router)
@@ -1,10 +1,12 @@
 from fastapi import APIRouter
 from fastapi import Depends
 from fastapi import Body
+from fastapi import Request
 from fastapi.security import OAuth2PasswordRequestForm
 
 from ..models.auth import UserCreate, User
 from ..models.auth import Token
+from ..models.auth import RefreshRequest
 from ..services.auth import AuthService, get_current_user
 
 
@@ -23,15 +25,25 @@ async def sign_up(
 
 @router.post('/sign-in', response_model=Token)
 async def sign_in(
+        request: Request,
         form_data: OAuth2PasswordRequestForm = Depends(),
         service: AuthService = Depends(),
 ):
     return await service.authenticate_user(
         form_data.username,
         form_data.password,
+        request.client.host if request.client else 'unknown',
     )
 
 
+@router.post('/refresh', response_model=Token)
+async def refresh(
+        data: RefreshRequest = Body(...),
+        service: AuthService = Depends(),
+):
+    return await service.refresh(data.refresh_token)
+
+
 @router.get('/user', response_model=User)
 def get_user(user: User = Depends(get_current_user)):
     return user
@@ -1,8 +1,16 @@
+from typing import Optional
+
+from aioredis import Redis
 from fastapi import APIRouter
+from fastapi import Body
 from fastapi import Depends
+from fastapi import Header
 from fastapi import Query
 
 from ..models.auth import User
+from ..models.emoticon import EmoticonBatch
+from ..models.emoticon import EmoticonBatchRequest
+from ..redis.connection import get_state_session
 from ..services.auth import get_current_user
 from ..services.emoticon import EmoticonService
 
@@ -14,8 +22,20 @@ router = APIRouter(
 @router.get('/')
 async def emoticon(
         username: str = Query(None, description='Логин пользователя'),
+        if_none_match: Optional[str] = Header(None),
         user: User = Depends(get_current_user),
         service: EmoticonService = Depends(),
 ):
     await service.validate_data(user.username, username)
-    return await service.get_user_emoticon(user.username)
+    return await service.get_user_emoticon(user.username, if_none_match)
+
+
+@router.post('/batch', response_model=EmoticonBatch)
+async def emoticon_batch(
+        batch: EmoticonBatchRequest = Body(...),
+        user: User = Depends(get_current_user),
+        service: EmoticonService = Depends(),
+        state_redis: Redis = Depends(get_state_session),
+) -> EmoticonBatch:
+    return await service.get_batch(user.username, batch.usernames,
+                                   state_redis)
@@ -0,0 +1,46 @@
+import asyncio
+
+from fastapi import APIRouter
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+from ..db.connection import database
+from ..lifecycle import readiness
+from ..redis.connection import redis_pool
+from ..redis.connection import state_pool
+from ..settings import settings
+
+
+router = APIRouter()
+
+
+async def _check(coro) -> str:
+    try:
+        await asyncio.wait_for(coro, settings.readiness_timeout)
+    except Exception as exc:
+        return f'error: {exc!r}'
+    return 'ok'
+
+
+@router.get('/healthz')
+async def healthz() -> dict:
+    # liveness: процесс жив и event loop отвечает
+    return {'status': 'ok'}
+
+
+@router.get('/readyz')
+async def readyz() -> JSONResponse:
+    checks = {'startup': 'ok' if readiness.ready else 'in progress'}
+    if readiness.ready:
+        checks['database'] = await _check(database.execute('SELECT 1'))
+        checks['redis'] = await _check(redis_pool.client().ping())
+        if state_pool is not redis_pool:
+            checks['redis_state'] = await _check(state_pool.client().ping())
+
+    ready = all(check == 'ok' for check in checks.values())
+    return JSONResponse(
+        status_code=(status.HTTP_200_OK if ready
+                     else status.HTTP_503_SERVICE_UNAVAILABLE),
+        content={'status': 'ready' if ready else 'not ready',
+                 'checks': checks},
+    )
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import generate_latest
+
+from ..metrics import collect_registry
+from ..metrics import sample_tracked
+
+
+router = APIRouter()
+
+
+# обычная функция: fastapi выполнит ее в пуле потоков, и чтение файлов
+# метрик в multiprocess-режиме не блокирует event loop
+@router.get('/metrics', include_in_schema=False)
+def metrics() -> Response:
+    sample_tracked()
+    return Response(
+        content=generate_latest(collect_registry()),
+        media_type=CONTENT_TYPE_LATEST,
+    )
@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from typing import (ContextManager, Dict, Iterable, Iterator, List, Optional,
+                    TextIO, Tuple)
+
+import aioredis
+import asyncpg
+from aioredis.exceptions import RedisError
+
+from .constants import PASSWORD_MIN_LENGTH
+from .constants import USERNAME_MAX_LENGTH
+from .services.hashing import context
+from .services.usernames import username_filter
+from .settings import settings
+
+
+# Массовая загрузка и выгрузка пользователей в обход /auth/sign-up:
+#   python -m src.workshop.bulk import users.csv --workers 8
+#   python -m src.workshop.bulk export --output users.jsonl
+# Строки файла: username и password (или готовый password_hash, например
+# из выгрузки). Пароли хэшируются в пуле процессов, пачки загружаются
+# через COPY во временную таблицу и переносятся в users одним INSERT.
+# Прогресс пишется в stderr, итог загрузки - JSON в stdout.
+FIELDS = ('id', 'username', 'password_hash')
+
+CREATE_STAGING = ('CREATE TEMPORARY TABLE users_staging '
+                  '(username text, password_hash text) '
+                  'ON COMMIT DELETE ROWS')
+# повторы имени внутри пачки схлопываются, xmax = 0 у вставленных строк
+INSERT_FROM_STAGING = """
+INSERT INTO users (username, password_hash)
+SELECT DISTINCT ON (username) username, password_hash
+FROM users_staging
+ORDER BY username
+ON CONFLICT (username) DO {action}
+RETURNING username, (xmax = 0) AS inserted
+"""
+SKIP_EXISTING = 'NOTHING'
+UPDATE_EXISTING = 'UPDATE SET password_hash = EXCLUDED.password_hash'
+SELECT_USERS = 'SELECT id, username, password_hash FROM users ORDER BY id'
+
+Row = Tuple[int, Dict[str, str]]
+
+
+def hash_password(password: str) -> str:
+    return context.hash(password)
+
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.read = 0
+        self.invalid = 0
+        self.inserted = 0
+        self.updated = 0
+        self.duplicates = 0
+        self.filter_failed = False
+
+    def as_dict(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        loaded = self.inserted + self.updated
+        return {
+            'read': self.read,
+            'invalid': self.invalid,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'duplicates': self.duplicates,
+            'seconds': round(elapsed, 1),
+            'rows_per_second': round(loaded / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def progress(self) -> str:
+        stats = self.as_dict()
+        return (f"{stats['read']} read, {stats['inserted']} inserted, "
+                f"{stats['updated']} updated, "
+                f"{stats['duplicates']} duplicates, "
+                f"{stats['invalid']} invalid, "
+                f"{stats['rows_per_second']} rows/s")
+
+
+def detect_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return 'csv' if path.endswith('.csv') else 'jsonl'
+
+
+def read_rows(file: TextIO, fmt: str) -> Iterator[Row]:
+    """Строки файла с номером (для сообщений об ошибках)."""
+    if fmt == 'csv':
+        # номер строки с учетом заголовка
+        for number, row in enumerate(csv.DictReader(file), start=2):
+            yield number, row
+        return
+
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else {}
+
+
+def batches(rows: Iterable[Row], size: int) -> Iterator[List[Row]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def check_row(row: Dict[str, str]) -> Optional[str]:
+    """Причина, по которой строку нельзя загрузить, или None."""
+    username = row.get('username')
+    password = row.get('password')
+    password_hash = row.get('password_hash')
+
+    # в JSONL значения могут быть числами, списками и т.п.
+    if not isinstance(username, str) or not username or \
+            len(username) > USERNAME_MAX_LENGTH:
+        return 'bad username'
+    for field in ('password', 'password_hash'):
+        if row.get(field) is not None and not isinstance(row[field], str):
+            return f'{field} must be a string'
+    if bool(password) == bool(password_hash):
+        return 'expected either password or password_hash'
+    if password and len(password) < PASSWORD_MIN_LENGTH:
+        return 'password is too short'
+    if password_hash and context.identify(password_hash,
+                                          required=False) is None:
+        return 'unknown password_hash scheme'
+    return None
+
+
+async def hash_batch(executor: Executor,
+                     rows: List[Dict[str, str]]) -> List[Tuple[str, str]]:
+    loop = asyncio.get_running_loop()
+
+    async def prepare(row: Dict[str, str]) -> Tuple[str, str]:
+        if row.get('password_hash'):
+            return row['username'], row['password_hash']
+        password_hash = await loop.run_in_executor(executor, hash_password,
+                                                   row['password'])
+        return row['username'], password_hash
+
+    return await asyncio.gather(*(prepare(row) for row in rows))
+
+
+async def connect_postgres() -> asyncpg.Connection:
+    # без command_timeout приложения: COPY большой пачки может быть долгим
+    return await asyncpg.connect(
+        host=settings.pg_host,
+        port=settings.pg_port,
+        user=settings.pg_user,
+        password=settings.pg_pass,
+        database=settings.pg_db_name,
+    )
+
+
+async def load_batch(connection: asyncpg.Connection,
+                     records: List[Tuple[str, str]],
+                     update_existing: bool,
+                     stats: ImportStats) -> List[str]:
+    """Загружает пачку; возвращает имена новых пользователей."""
+    action = UPDATE_EXISTING if update_existing else SKIP_EXISTING
+    async with connection.transaction():
+        await connection.copy_records_to_table(
+            'users_staging',
+            records=records,
+            columns=('username', 'password_hash'),
+        )
+        result = await connection.fetch(
+            INSERT_FROM_STAGING.format(action=action),
+        )
+
+    inserted = [row['username'] for row in result if row['inserted']]
+    stats.inserted += len(inserted)
+    stats.updated += len(result) - len(inserted)
+    stats.duplicates += len(records) - len(result)
+    return inserted
+
+
+async def add_to_filter(redis: aioredis.Redis,
+                        usernames: List[str],
+                        stats: ImportStats) -> None:
+    if not await username_filter.add(redis, *usernames):
+        stats.filter_failed = True
+
+
+async def run_import(file: TextIO,
+                     fmt: str,
+                     batch_size: int,
+                     workers: int,
+                     update_existing: bool) -> Dict:
+    stats = ImportStats()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    connection = await connect_postgres()
+    redis = aioredis.from_url(settings.state_redis_url)
+    try:
+        await connection.execute(CREATE_STAGING)
+
+        # пока пачка грузится в базу, следующая уже хэшируется
+        hashing: Optional[asyncio.Future] = None
+        for batch in batches(read_rows(file, fmt), batch_size):
+            valid = []
+            for number, row in batch:
+                stats.read += 1
+                reason = check_row(row)
+                if reason is None:
+                    valid.append(row)
+                    continue
+                stats.invalid += 1
+                print(f'line {number}: {reason}', file=sys.stderr)
+
+            following = asyncio.ensure_future(hash_batch(executor, valid))
+            if hashing is not None:
+                await load_and_report(connection, redis, await hashing,
+                                      update_existing, stats)
+            hashing = following
+
+        if hashing is not None:
+            await load_and_report(connection, redis, await hashing,
+                                  update_existing, stats)
+
+        if stats.filter_failed:
+            await invalidate_filter(redis)
+    finally:
+        await connection.close()
+        await redis.close()
+        executor.shutdown(cancel_futures=True)
+
+    return stats.as_dict()
+
+
+async def load_and_report(connection: asyncpg.Connection,
+                          redis: aioredis.Redis,
+                          records: List[Tuple[str, str]],
+                          update_existing: bool,
+                          stats: ImportStats) -> None:
+    if records:
+        inserted = await load_batch(connection, records, update_existing,
+                                    stats)
+        await add_to_filter(redis, inserted, stats)
+    print(stats.progress(), file=sys.stderr)
+
+
+async def invalidate_filter(redis: aioredis.Redis) -> None:
+    # иначе приложение отклоняло бы вход новых пользователей
+    try:
+        await username_filter.invalidate(redis)
+    except RedisError as exc:
+        print(f'Username filter is stale ({exc!r}): run DEL usernames '
+              f'in redis or restart the application', file=sys.stderr)
+
+
+def write_row(file: TextIO,
+              record: asyncpg.Record,
+              writer: Optional[csv.DictWriter]) -> None:
+    row = dict(record)
+    if writer is not None:
+        writer.writerow(row)
+    else:
+        file.write(json.dumps(row) + '\n')
+
+
+async def run_export(file: TextIO, fmt: str, batch_size: int) -> Dict:
+    started = time.perf_counter()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+
+    count = 0
+    connection = await connect_postgres()
+    try:
+        # серверный курсор: в памяти не больше batch_size строк
+        async with connection.transaction(readonly=True):
+            async for record in connection.cursor(SELECT_USERS,
+                                                  prefetch=batch_size):
+                write_row(file, record, writer)
+                count += 1
+                if count % batch_size == 0:
+                    print(f'{count} exported', file=sys.stderr)
+    finally:
+        await connection.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'exported': count,
+        'seconds': round(elapsed, 1),
+        'rows_per_second': round(count / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def open_input(path: str) -> ContextManager[TextIO]:
+    if path == '-':
+        return nullcontext(sys.stdin)
+    return open(path, newline='', encoding='utf-8')
+
+
+def open_output(path: Optional[str]) -> ContextManager[TextIO]:
+    if not path or path == '-':
+        return nullcontext(sys.stdout)
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Массовая загрузка и выгрузка пользователей',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('import', help='загрузить из CSV или JSONL')
+    load.add_argument('input', help='файл или - для stdin')
+    load.add_argument('--format', choices=('csv', 'jsonl'),
+                      help='по умолчанию - по расширению файла')
+    load.add_argument('--batch-size', type=int, default=1000)
+    load.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                      help='процессов для хэширования паролей')
+    load.add_argument('--update-existing', action='store_true',
+                      help='заменить хэш пароля у существующих имен '
+                           '(по умолчанию такие строки пропускаются)')
+
+    dump = commands.add_parser('export',
+                               help='выгрузить (вместе с хэшами паролей)')
+    dump.add_argument('--output', help='файл (по умолчанию stdout)')
+    dump.add_argument('--format', choices=('csv', 'jsonl'))
+    dump.add_argument('--batch-size', type=int, default=1000)
+
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        fmt = detect_format(args.input, args.format)
+        with open_input(args.input) as file:
+            result = asyncio.run(run_import(file, fmt, args.batch_size,
+                                            args.workers,
+                                            args.update_existing))
+        print(json.dumps(result, indent=2))
+        return
+
+    fmt = detect_format(args.output or '', args.format)
+    with open_output(args.output) as file:
+        result = asyncio.run(run_export(file, fmt, args.batch_size))
+    print(json.dumps(result), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from ..settings import settings
+from ..metrics import EMOTICON_L1_BYTES
+from ..metrics import EMOTICON_L1_ENTRIES
+from ..metrics import EMOTICON_L1_REQUESTS
+from ..metrics import track
+
+
+class CachedImage(NamedTuple):
+    image: bytes
+    etag: str
+
+
+class ImageCache:
+    """LRU картинок в памяти воркера, ограниченный суммарным размером.
+
+    Запись свежая ttl секунд. Еще stale_ttl секунд после этого ее можно
+    получить через get_stale - на случай, если redis недоступен.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, stale_ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.size = 0
+        self._entries: 'OrderedDict[str, Tuple[CachedImage, float]]' = \
+            OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[CachedImage]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            cached, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                self._entries.move_to_end(key)
+                EMOTICON_L1_REQUESTS.labels(result='hit').inc()
+                return cached
+            if age >= self.ttl + self.stale_ttl:
+                self.discard(key)
+
+        EMOTICON_L1_REQUESTS.labels(result='miss').inc()
+        return None
+
+    def get_stale(self, key: str) -> Optional[CachedImage]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        cached, stored_at = entry
+        if time.monotonic() - stored_at >= self.ttl + self.stale_ttl:
+            self.discard(key)
+            return None
+
+        EMOTICON_L1_REQUESTS.labels(result='stale').inc()
+        return cached
+
+    def put(self, key: str, cached: CachedImage) -> None:
+        if len(cached.image) > self.max_bytes:
+            return
+
+        self.discard(key)
+        self._entries[key] = (cached, time.monotonic())
+        self.size += len(cached.image)
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.size -= len(evicted.image)
+
+    def discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0].image)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+image_cache = ImageCache(
+    max_bytes=settings.emoticon_l1_max_bytes,
+    ttl=settings.emoticon_l1_ttl,
+    stale_ttl=settings.emoticon_l1_stale_ttl,
+)
+track(EMOTICON_L1_BYTES, lambda: image_cache.size)
+track(EMOTICON_L1_ENTRIES, lambda: len(image_cache))
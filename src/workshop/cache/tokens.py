@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from ..models.auth import User
+from ..settings import settings
+from ..metrics import JWT_CACHE_REQUESTS
+from ..metrics import JWT_CACHE_SIZE
+from ..metrics import track
+
+
+class TokenCache:
+    """LRU уже проверенных токенов: sha256(token) -> (User, exp).
+
+    Запись никогда не отдается после exp токена.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: 'OrderedDict[bytes, Tuple[User, float]]' = \
+            OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user, exp = entry
+                if exp > time.time():
+                    self._entries.move_to_end(key)
+                    JWT_CACHE_REQUESTS.labels(result='hit').inc()
+                    return user
+                del self._entries[key]
+
+        JWT_CACHE_REQUESTS.labels(result='miss').inc()
+        return None
+
+    def put(self, key: bytes, user: User, exp: float) -> None:
+        if self.maxsize <= 0 or exp <= time.time():
+            return
+
+        with self._lock:
+            self._entries[key] = (user, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(settings.jwt_cache_size)
+track(JWT_CACHE_SIZE, lambda: len(token_cache))
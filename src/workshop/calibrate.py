@@ -0,0 +1,86 @@
+import argparse
+import json
+import math
+import os
+import time
+from typing import Dict, List
+
+from passlib.registry import get_crypt_handler
+
+from .settings import settings
+
+
+# Подбор числа раундов хэширования под железо:
+#   python -m src.workshop.calibrate --target-ms 250
+# Печатает JSON с замерами и рекомендацией для PASSWORD_ROUNDS.
+# Хэши с меньшим числом раундов обновятся при следующем входе пользователя.
+PASSWORD = 'calibration-password'
+
+
+def measure(scheme: str, rounds: int, samples: int) -> float:
+    """Медианное время одного хэширования в секундах."""
+    handler = get_crypt_handler(scheme).using(rounds=rounds)
+    durations: List[float] = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.hash(PASSWORD)
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    return durations[len(durations) // 2]
+
+
+def recommend(scheme: str, rounds: int, seconds: float,
+              target: float) -> int:
+    """Экстраполирует число раундов от замера до целевого времени."""
+    handler = get_crypt_handler(scheme)
+    if handler.rounds_cost == 'log2':
+        value = rounds + math.floor(math.log2(target / seconds))
+    else:
+        value = math.floor(rounds * target / seconds)
+    return max(handler.min_rounds, min(handler.max_rounds, value))
+
+
+def calibrate(scheme: str, target_ms: float, samples: int) -> Dict:
+    handler = get_crypt_handler(scheme)
+    if 'rounds' not in getattr(handler, 'setting_kwds', ()):
+        raise SystemExit(f'Схема {scheme} не поддерживает число раундов')
+
+    current = settings.password_rounds.get(scheme, handler.default_rounds)
+    seconds = measure(scheme, current, samples)
+    rounds = recommend(scheme, current, seconds, target_ms / 1000)
+    recommended = seconds if rounds == current else \
+        measure(scheme, rounds, samples)
+
+    return {
+        'scheme': scheme,
+        'target_ms': target_ms,
+        'cpu_count': os.cpu_count(),
+        'current': {
+            'rounds': current,
+            'hash_ms': round(seconds * 1000, 1),
+        },
+        'recommended': {
+            'rounds': rounds,
+            'hash_ms': round(recommended * 1000, 1),
+            # проверка пароля стоит столько же, сколько хэширование
+            'sign_ins_per_core': round(1 / recommended, 1),
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Подбор числа раундов хэширования паролей',
+    )
+    parser.add_argument('--target-ms', type=float, default=250.0,
+                        help='желаемое время одного хэширования')
+    parser.add_argument('--scheme', default=settings.password_schemes[0])
+    parser.add_argument('--samples', type=int, default=5)
+    args = parser.parse_args()
+
+    result = calibrate(args.scheme, args.target_ms, args.samples)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
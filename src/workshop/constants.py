@@ -1,7 +1,34 @@
 LOG_DIR = './logs'
+# отдельный файл на воркер: см. create_file_handler
+LOG_FILE = f'{LOG_DIR}/all-{{pid}}.log'
 INCORRECT_USERNAME_OR_PASS_MESSAGE = 'Incorrect username or password'
 INCORRECT_TOKEN_MESSAGE = 'Could not validate token'
+USERNAME_MAX_LENGTH = 20
+PASSWORD_MIN_LENGTH = 4
+SERVICE_BUSY_MESSAGE = 'Service is busy, try again later'
+TOO_MANY_ATTEMPTS_MESSAGE = 'Too many sign-in attempts, try again later'
 UNAUTHORIZED_MESSAGE = 'Not authenticated'  # OAuth2PasswordBearer constant (fastapi)
 FORMATTER_TEMPLATE = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 EMOTICON_SERVICE = 'http://emoticon:8080/monster'
 EMOTICON_POSTFIX = '_emoticon'
+EMOTICON_LOCK_POSTFIX = '_emoticon_lock'
+EMOTICON_ETAG_POSTFIX = '_emoticon_etag'
+EMOTICON_FORBIDDEN = 'forbidden'
+EMOTICON_UNAVAILABLE = 'unavailable'
+EMOTICON_NOT_FOUND = 'not_found'
+EMOTICON_ERROR_POSTFIX = '_emoticon_error'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PROFILER_RATE_KEY = 'profiler_rate'
+SIGNIN_USERNAME_PREFIX = 'signin_rate_user:'
+SIGNIN_IP_PREFIX = 'signin_rate_ip:'
+REFRESH_FAMILY_PREFIX = 'refresh_family:'
+USERNAMES_KEY = 'usernames'
+USERNAMES_BUILD_KEY = 'usernames:building'
+USERNAMES_LOCK_KEY = 'usernames:lock'
+# удаляет блокировку, только если она все еще принадлежит нам
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
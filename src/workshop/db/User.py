@@ -1,6 +1,7 @@
 from ormar import Model
 from ormar import Integer, String
 
+from src.workshop.constants import USERNAME_MAX_LENGTH
 from src.workshop.db.connection import metadata
 from src.workshop.db.connection import database
 
@@ -12,5 +13,7 @@ class User(Model):
         tablename = 'users'
 
     id: int = Integer(primary_key=True, autoincrement=True, nullable=False)
-    username: str = String(max_length=20, unique=True, nullable=False)
+    username: str = String(max_length=USERNAME_MAX_LENGTH,
+                           unique=True,
+                           nullable=False)
     password_hash: str = String(max_length=200, nullable=False)
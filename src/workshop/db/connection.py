@@ -4,6 +4,8 @@ from sqlalchemy import MetaData
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.engine.url import URL as DB_URL
 
+from src.workshop.metrics import DB_POOL_CONNECTIONS
+from src.workshop.metrics import track
 from src.workshop.settings import settings
 
 
@@ -19,6 +21,30 @@ Base = declarative_base()
 engine = create_engine(connection_url)
 
 # ормар берет либо str либо свой класс ссылки
-database = Database(connection_url.__str__())
+database = Database(
+    connection_url.__str__(),
+    min_size=min(settings.pg_pool_min_size, settings.pg_pool_size),
+    max_size=settings.pg_pool_size,
+    command_timeout=settings.pg_command_timeout,
+    statement_cache_size=settings.pg_statement_cache_size,
+)
 
 metadata = MetaData()
+
+
+def pool_connections(state: str) -> int:
+    # пул asyncpg создается только при database.connect()
+    pool = getattr(database._backend, '_pool', None)
+    if pool is None:
+        return 0
+    if state == 'idle':
+        return pool.get_idle_size()
+    return pool.get_size()
+
+
+track(DB_POOL_CONNECTIONS.labels(state='created'),
+      lambda: pool_connections('created'))
+track(DB_POOL_CONNECTIONS.labels(state='idle'),
+      lambda: pool_connections('idle'))
+track(DB_POOL_CONNECTIONS.labels(state='max'),
+      lambda: settings.pg_pool_size)
@@ -0,0 +1,71 @@
+from typing import AsyncIterator, List, NamedTuple, Optional, Set
+
+from src.workshop.db.connection import database
+
+
+# Запросы идут напрямую в соединение asyncpg в обход ormar: текст запроса
+# постоянный, поэтому asyncpg готовит выражение один раз и дальше берет его
+# из своего кэша (pg_statement_cache_size), а из строки выбираются только
+# нужные колонки без сборки модели.
+GET_CREDENTIALS = 'SELECT id, password_hash FROM users WHERE username = $1'
+CREATE_USER = ('INSERT INTO users (username, password_hash) '
+               'VALUES ($1, $2) RETURNING id')
+UPDATE_PASSWORD_HASH = 'UPDATE users SET password_hash = $2 WHERE id = $1'
+SELECT_USERNAMES = 'SELECT username FROM users'
+SELECT_EXISTING = 'SELECT username FROM users WHERE username = ANY($1)'
+
+
+class UserCredentials(NamedTuple):
+    id: int
+    username: str
+    password_hash: str
+
+
+async def get_credentials(username: str) -> Optional[UserCredentials]:
+    async with database.connection() as connection:
+        row = await connection.raw_connection.fetchrow(
+            GET_CREDENTIALS, username,
+        )
+    if row is None:
+        return None
+    return UserCredentials(row['id'], username, row['password_hash'])
+
+
+async def create_user(username: str, password_hash: str) -> UserCredentials:
+    """Бросает asyncpg.UniqueViolationError, если имя уже занято"""
+    async with database.connection() as connection:
+        user_id = await connection.raw_connection.fetchval(
+            CREATE_USER, username, password_hash,
+        )
+    return UserCredentials(user_id, username, password_hash)
+
+
+async def update_password_hash(user_id: int, password_hash: str) -> None:
+    async with database.connection() as connection:
+        await connection.raw_connection.execute(
+            UPDATE_PASSWORD_HASH, user_id, password_hash,
+        )
+
+
+async def existing_usernames(usernames: List[str]) -> Set[str]:
+    async with database.connection() as connection:
+        rows = await connection.raw_connection.fetch(
+            SELECT_EXISTING, usernames,
+        )
+    return {row['username'] for row in rows}
+
+
+async def iter_usernames(batch_size: int) -> AsyncIterator[List[str]]:
+    """Все имена пачками через курсор, не загружая таблицу в память."""
+    async with database.connection() as connection:
+        raw = connection.raw_connection
+        async with raw.transaction():
+            batch: List[str] = []
+            async for record in raw.cursor(SELECT_USERNAMES,
+                                           prefetch=batch_size):
+                batch.append(record['username'])
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
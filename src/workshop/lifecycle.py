@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from .db.connection import database
+from .db.connection import engine
+from .db.connection import metadata
+from .redis.connection import redis_pool
+from .redis.connection import state_pool
+from .redis.memory import redis_memory_monitor
+from .services.hashing import password_hasher
+from .services.prefetch import emoticon_prefetcher
+from .services.usernames import username_filter
+from .upstream.connection import http_client
+from .settings import settings
+from .metrics import STARTUP_STEP_SECONDS
+from .metrics import gauge_sampler
+from .metrics import mark_process_dead
+from .profiler import request_profiler
+
+
+T = TypeVar('T')
+
+# ключ pg_advisory_lock для создания схемы
+SCHEMA_LOCK_ID = 0x5C4E3A
+
+logger = logging.getLogger('main.lifecycle')
+
+
+class Readiness:
+    """Готов ли воркер принимать трафик (для /readyz)."""
+
+    def __init__(self):
+        self.ready = False
+        self.steps: Dict[str, float] = {}
+
+
+readiness = Readiness()
+
+
+@asynccontextmanager
+async def timed_step(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        readiness.steps[name] = elapsed
+        STARTUP_STEP_SECONDS.labels(step=name).set(elapsed)
+        logger.info(f'Startup step {name} took {elapsed:.3f}s')
+
+
+async def with_backoff(name: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """Повторяет fn с экспоненциальной задержкой, но не бесконечно."""
+    delay = settings.startup_backoff_initial
+    for attempt in range(1, settings.startup_max_attempts + 1):
+        try:
+            return await fn()
+        except Exception as exc:
+            if attempt == settings.startup_max_attempts:
+                raise
+            pause = delay * random.uniform(0.5, 1.5)
+            logger.info(f'{name} is not available ({exc!r}), '
+                        f'retry {attempt} in {pause:.2f}s')
+            await asyncio.sleep(pause)
+            delay = min(delay * 2, settings.startup_backoff_max)
+
+
+async def connect_database() -> None:
+    if not database.is_connected:
+        await database.connect()
+    await database.execute('SELECT 1')
+
+
+async def ensure_schema() -> None:
+    """DDL выполняется, только если каких-то таблиц еще нет.
+
+    Воркеры стартуют одновременно: проверку и CREATE TABLE выполняет
+    один из них под advisory-блокировкой, остальные ждут и видят таблицы.
+    """
+    async with database.connection() as connection:
+        raw = connection.raw_connection
+        await raw.execute('SELECT pg_advisory_lock($1)', SCHEMA_LOCK_ID)
+        try:
+            missing = []
+            for table in metadata.sorted_tables:
+                exists = await raw.fetchval(
+                    'SELECT to_regclass($1) IS NOT NULL', table.name,
+                )
+                if not exists:
+                    missing.append(table.name)
+
+            if missing:
+                logger.info(f'Creating missing tables: {missing}')
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, metadata.create_all, engine)
+        finally:
+            await raw.execute('SELECT pg_advisory_unlock($1)',
+                              SCHEMA_LOCK_ID)
+
+
+async def warm_redis() -> None:
+    pools = {redis_pool, state_pool}
+    for pool in pools:
+        await pool.connect()
+    # открываем сразу несколько соединений, чтобы первые запросы их не ждали
+    await asyncio.gather(
+        *(pool.client().ping()
+          for pool in pools
+          for _ in range(settings.redis_pool_warm_size))
+    )
+
+
+async def startup() -> None:
+    async with timed_step('database'):
+        await with_backoff('database', connect_database)
+    async with timed_step('schema'):
+        await with_backoff('schema', ensure_schema)
+    async with timed_step('redis'):
+        await with_backoff('redis', warm_redis)
+    async with timed_step('http'):
+        await http_client.connect()
+    async with timed_step('usernames'):
+        await username_filter.start()
+    async with timed_step('workers'):
+        password_hasher.start()
+        emoticon_prefetcher.start()
+        redis_memory_monitor.start()
+        gauge_sampler.start()
+        request_profiler.start()
+
+    readiness.ready = True
+    logger.info(f'Startup took {sum(readiness.steps.values()):.3f}s')
+
+
+async def shutdown() -> None:
+    readiness.ready = False
+
+    await emoticon_prefetcher.stop()
+    await username_filter.stop()
+    await redis_memory_monitor.stop()
+    await gauge_sampler.stop()
+    await request_profiler.stop()
+
+    if database.is_connected:
+        await database.disconnect()
+
+    await redis_pool.disconnect()
+    await state_pool.disconnect()
+    await http_client.disconnect()
+    password_hasher.shutdown()
+    mark_process_dead()
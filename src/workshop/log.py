@@ -0,0 +1,153 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from logging.handlers import RotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler
+from typing import List, Optional
+
+from .constants import FORMATTER_TEMPLATE
+from .metrics import LOG_RECORDS_DROPPED
+from .settings import settings
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate INFO-записей (и ниже) указанных логгеров.
+
+    Предупреждения и ошибки проходят всегда.
+    """
+
+    def __init__(self, rate: float, loggers: List[str]):
+        super().__init__()
+        self.rate = rate
+        self.loggers = tuple(loggers)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or self.rate >= 1:
+            return True
+        if not record.name.startswith(self.loggers):
+            return True
+        return random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Кладет запись в очередь, не дожидаясь места в ней.
+
+    Если поток записи не успевает (например, диск подвис), лишние записи
+    отбрасываются и считаются (log_records_dropped_total), а event loop
+    не блокируется.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # очередь внутри процесса, запись не сериализуется: exc_info
+        # остается у записи, и traceback форматирует обработчик
+        # (в JSON - отдельным полем, а не внутри message)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+def create_formatter() -> logging.Formatter:
+    if settings.log_json:
+        return JsonFormatter()
+    return logging.Formatter(FORMATTER_TEMPLATE)
+
+
+def create_file_handler(path: str) -> logging.Handler:
+    # {pid} в пути - отдельный файл на воркер: ротация одного файла
+    # несколькими процессами теряет записи
+    path = path.format(pid=os.getpid())
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if settings.log_rotation == 'time':
+        return TimedRotatingFileHandler(
+            path,
+            when=settings.log_rotation_when,
+            backupCount=settings.log_backup_count,
+            encoding='utf-8',
+        )
+    return RotatingFileHandler(
+        path,
+        maxBytes=settings.log_max_bytes,
+        backupCount=settings.log_backup_count,
+        encoding='utf-8',
+    )
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging() -> None:
+    """Логгер main пишет в очередь, файл и stdout - в отдельном потоке."""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = create_formatter()
+    handlers: List[logging.Handler] = []
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+
+    if settings.log_file:
+        file_handler = create_file_handler(settings.log_file)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    queue_handler = DroppingQueueHandler(
+        queue.Queue(maxsize=settings.log_queue_size),
+    )
+    queue_handler.addFilter(SamplingFilter(settings.log_sample_rate,
+                                           settings.log_sampled_loggers))
+
+    logger = logging.getLogger('main')
+    logger.setLevel(settings.log_level)
+    logger.addHandler(queue_handler)
+
+    _listener = QueueListener(queue_handler.queue, *handlers,
+                              respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Дописывает оставшиеся в очереди записи и останавливает поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    _listener = None
@@ -0,0 +1,248 @@
+import asyncio
+import os
+from typing import Callable, List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import REGISTRY
+from prometheus_client import multiprocess
+
+from .settings import settings
+
+
+# при нескольких воркерах uvicorn каждый пишет метрики в файлы этого
+# каталога, а /metrics собирает их вместе (каталог очищается до запуска)
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0)
+
+STARTUP_STEP_SECONDS = Gauge(
+    'startup_step_seconds',
+    'Time spent in each startup step of this worker',
+    ['step'],
+    multiprocess_mode='liveall',
+)
+EMOTICON_UPSTREAM_FETCHES = Counter(
+    'emoticon_upstream_fetches_total',
+    'Number of requests sent to the upstream emoticon service',
+)
+EMOTICON_UPSTREAM_ERRORS = Counter(
+    'emoticon_upstream_errors_total',
+    'Failed or rejected requests to the upstream emoticon service',
+    ['reason'],
+)
+UPSTREAM_BREAKER_STATE = Gauge(
+    'upstream_breaker_state',
+    'Circuit breaker state (1 for the current state)',
+    ['breaker', 'state'],
+    multiprocess_mode='livesum',
+)
+UPSTREAM_BREAKER_TRANSITIONS = Counter(
+    'upstream_breaker_transitions_total',
+    'Circuit breaker state changes',
+    ['breaker', 'state'],
+)
+UPSTREAM_OUTSTANDING = Gauge(
+    'upstream_outstanding_requests',
+    'Requests in flight per upstream emoticon endpoint',
+    ['endpoint'],
+    multiprocess_mode='livesum',
+)
+UPSTREAM_ENDPOINT_DOWN = Counter(
+    'upstream_endpoint_down_total',
+    'Times an upstream endpoint was taken out by passive health checks',
+    ['endpoint'],
+)
+UPSTREAM_EXTRA_REQUESTS = Counter(
+    'upstream_extra_requests_total',
+    'Second requests sent to another replica (hedge or failover)',
+    ['reason'],
+)
+UPSTREAM_EXTRA_WINS = Counter(
+    'upstream_extra_request_wins_total',
+    'Second requests whose response was used',
+)
+EMOTICON_COALESCED = Counter(
+    'emoticon_coalesced_requests_total',
+    'Cache misses served by an already running upstream fetch',
+    ['scope'],
+)
+REDIS_POOL_CONNECTIONS = Gauge(
+    'redis_pool_connections',
+    'Redis connection pool usage',
+    ['state'],
+    multiprocess_mode='livesum',
+)
+REDIS_MEMORY_BYTES = Gauge(
+    'redis_memory_bytes',
+    'Redis memory usage and configured budget',
+    ['kind'],
+    # livemax появился только в prometheus_client 0.14; значение общее для
+    # всех воркеров, поэтому устаревший файл умершего воркера не страшен
+    multiprocess_mode='max',
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    'password_hash_seconds',
+    'Time spent hashing or verifying a password',
+    ['operation'],
+)
+PASSWORD_HASH_QUEUE_SECONDS = Histogram(
+    'password_hash_queue_seconds',
+    'Time a password hashing job waited for a free executor worker',
+    ['operation'],
+)
+PASSWORD_HASH_PENDING = Gauge(
+    'password_hash_pending',
+    'Password hashing jobs queued or running',
+    multiprocess_mode='livesum',
+)
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped_total',
+    'Log records dropped because the log queue was full',
+)
+PASSWORD_HASH_REJECTED = Counter(
+    'password_hash_rejected_total',
+    'Password hashing jobs rejected because the queue was full',
+    ['operation'],
+)
+SIGNIN_REJECTED = Counter(
+    'signin_rejected_total',
+    'Sign-in attempts rejected before checking the password',
+    ['reason'],
+)
+JWT_CACHE_REQUESTS = Counter(
+    'jwt_cache_requests_total',
+    'Lookups in the verified token cache',
+    ['result'],
+)
+JWT_CACHE_SIZE = Gauge(
+    'jwt_cache_size',
+    'Entries in the verified token cache',
+    multiprocess_mode='livesum',
+)
+EMOTICON_L1_REQUESTS = Counter(
+    'emoticon_l1_requests_total',
+    'Lookups in the in-process emoticon cache',
+    ['result'],
+)
+EMOTICON_L1_BYTES = Gauge(
+    'emoticon_l1_bytes',
+    'Bytes held by the in-process emoticon cache',
+    multiprocess_mode='livesum',
+)
+EMOTICON_L1_ENTRIES = Gauge(
+    'emoticon_l1_entries',
+    'Images held by the in-process emoticon cache',
+    multiprocess_mode='livesum',
+)
+EMOTICON_PREFETCH = Counter(
+    'emoticon_prefetch_total',
+    'Background emoticon prefetch jobs by outcome',
+    ['result'],
+)
+EMOTICON_PREFETCH_QUEUE = Gauge(
+    'emoticon_prefetch_queue',
+    'Background emoticon prefetch jobs waiting in the queue',
+    multiprocess_mode='livesum',
+)
+EMOTICON_REFRESHES = Counter(
+    'emoticon_refreshes_total',
+    'Background refreshes of stale emoticons by outcome',
+    ['result'],
+)
+HTTP_REQUESTS = Counter(
+    'http_requests_total',
+    'HTTP requests by route template and status code',
+    ['method', 'route', 'status'],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_seconds',
+    'HTTP request latency by route template',
+    ['method', 'route'],
+)
+JWT_DECODE_SECONDS = Histogram(
+    'jwt_decode_seconds',
+    'Time spent decoding and verifying a JWT (token cache misses)',
+    buckets=FAST_BUCKETS,
+)
+REDIS_COMMAND_SECONDS = Histogram(
+    'redis_command_seconds',
+    'Latency of emoticon cache reads and writes in redis',
+    ['command'],
+    buckets=FAST_BUCKETS,
+)
+EMOTICON_UPSTREAM_SECONDS = Histogram(
+    'emoticon_upstream_seconds',
+    'Time until the upstream emoticon service answered with headers',
+)
+EMOTICON_CACHE_REQUESTS = Counter(
+    'emoticon_cache_requests_total',
+    'Lookups of emoticons in redis (after the in-process cache)',
+    ['result'],
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections',
+    'Postgres connection pool usage',
+    ['state'],
+    multiprocess_mode='livesum',
+)
+
+
+_tracked: List[Tuple[Gauge, Callable[[], float]]] = []
+
+
+def track(gauge: Gauge, fn: Callable[[], float]) -> None:
+    """Gauge, значение которого берется из fn.
+
+    В одном процессе это set_function: fn вызывается только при сборе.
+    В multiprocess-режиме set_function не попадает в файлы метрик, поэтому
+    значения переписываются периодически (GaugeSampler) и перед сбором.
+    """
+    if MULTIPROCESS:
+        _tracked.append((gauge, fn))
+    else:
+        gauge.set_function(fn)
+
+
+def sample_tracked() -> None:
+    for gauge, fn in _tracked:
+        gauge.set(fn())
+
+
+def collect_registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def mark_process_dead() -> None:
+    # live*-gauge завершившегося воркера больше не учитываются
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class GaugeSampler:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if MULTIPROCESS and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            sample_tracked()
+            await asyncio.sleep(settings.metrics_sample_interval)
+
+
+gauge_sampler = GaugeSampler()
@@ -0,0 +1,110 @@
+import logging
+import time
+from typing import Dict
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import HTTP_REQUESTS
+from .metrics import HTTP_REQUEST_SECONDS
+from .profiler import request_profiler
+from .settings import settings
+from .timing import server_timing
+from .timing import spans_hidden
+from .timing import start_request
+
+
+class MetricsMiddleware:
+    """Счетчик и гистограмма задержки запросов по шаблону маршрута.
+
+    Чистый ASGI: в отличие от BaseHTTPMiddleware не оборачивает ответ
+    в лишние задачи и не ломает стриминг. Метка - шаблон пути
+    (/emoticon/), а не сам путь, чтобы не плодить серии.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def route_name(self, scope: Scope) -> str:
+        # роутер starlette дописывает endpoint найденного маршрута в scope
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        if not self._routes:
+            self._routes = {route.endpoint: route.path
+                            for route in scope['app'].routes
+                            if hasattr(route, 'endpoint')}
+        return self._routes.get(endpoint, 'unmatched')
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = self.route_name(scope)
+            HTTP_REQUEST_SECONDS.labels(scope['method'], route).observe(
+                time.perf_counter() - started,
+            )
+            HTTP_REQUESTS.labels(scope['method'], route, status_code).inc()
+
+
+class TimingMiddleware:
+    """Разбивка времени запроса по участкам (timing.span).
+
+    Участки уходят клиенту в заголовке Server-Timing, запросы дольше
+    slow_request_threshold логируются вместе с ними. Для стриминга
+    в заголовок попадает время до начала ответа.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.logger = logging.getLogger('main.timing')
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        spans = start_request()
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            start = message['type'] == 'http.response.start'
+            if start and settings.server_timing_enabled:
+                public = {} if spans_hidden() else spans
+                header = server_timing(public, time.perf_counter() - started)
+                message = {
+                    **message,
+                    'headers': [*message.get('headers', []),
+                                (b'server-timing', header.encode())],
+                }
+            await send(message)
+
+        profile = None
+        if request_profiler.should_profile():
+            profile = request_profiler.begin()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            total = time.perf_counter() - started
+            if profile is not None:
+                name = scope['path'].strip('/').replace('/', '_') or 'root'
+                await request_profiler.finish(profile, name)
+            if total >= settings.slow_request_threshold:
+                self.logger.warning(
+                    f"Slow request {scope['method']} {scope['path']} "
+                    f'took {total:.3f}s: {server_timing(spans, total)}'
+                )
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -19,3 +21,8 @@ class User(BaseUser):
 class Token(BaseModel):
     access_token: str
     token_type: str = 'bearer'
+    refresh_token: Optional[str] = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
@@ -0,0 +1,12 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class EmoticonBatchRequest(BaseModel):
+    usernames: List[str]
+
+
+class EmoticonBatch(BaseModel):
+    images: Dict[str, Optional[str]]   # username -> png в base64
+    errors: Dict[str, str] = {}
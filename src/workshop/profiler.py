@@ -0,0 +1,84 @@
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import time
+from typing import Optional
+
+from aioredis.exceptions import RedisError
+
+from .constants import PROFILER_RATE_KEY
+from .redis.connection import redis_pool
+from .settings import settings
+
+
+class SamplingProfiler:
+    """Профилирует cProfile случайную долю запросов.
+
+    Доля берется из redis (ключ PROFILER_RATE_KEY), поэтому ее можно
+    менять на лету сразу для всех воркеров:
+        redis-cli SET profiler_rate 0.01   # 1% запросов
+        redis-cli DEL profiler_rate        # вернуть PROFILER_RATE
+    cProfile видит весь поток, поэтому в профиль попадают и запросы,
+    которые event loop выполнял параллельно; одновременно снимается
+    только один профиль.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('main.profiler')
+        self.rate = settings.profiler_rate
+        self._active = False
+        self._task: Optional[asyncio.Task] = None
+
+    def should_profile(self) -> bool:
+        if self._active or self.rate <= 0:
+            return False
+        return random.random() < self.rate
+
+    def begin(self) -> cProfile.Profile:
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    async def finish(self, profile: cProfile.Profile, name: str) -> None:
+        profile.disable()
+        self._active = False
+
+        os.makedirs(settings.profiler_dir, exist_ok=True)
+        path = os.path.join(
+            settings.profiler_dir,
+            f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{name}.prof',
+        )
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, profile.dump_stats, path)
+        self.logger.info(f'Profile saved to {path}')
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        redis = redis_pool.client()
+        while True:
+            try:
+                rate = await redis.get(PROFILER_RATE_KEY)
+                rate = (float(rate) if rate is not None
+                        else settings.profiler_rate)
+            except (RedisError, ValueError) as exc:
+                self.logger.info(f'Could not read profiler rate: {exc}')
+            else:
+                if rate != self.rate:
+                    self.logger.info(f'Profiler rate is {rate}')
+                self.rate = rate
+            await asyncio.sleep(settings.profiler_poll_interval)
+
+
+request_profiler = SamplingProfiler()
@@ -1,8 +1,81 @@
+from typing import Optional
+
 import aioredis
 
 from ..settings import settings
+from ..metrics import REDIS_POOL_CONNECTIONS
+from ..metrics import track
+
+
+class RedisPool:
+    """Общий пул соединений с redis (один на воркер)."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._pool: Optional[aioredis.BlockingConnectionPool] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._pool is not None
+
+    @property
+    def pool(self) -> aioredis.BlockingConnectionPool:
+        if self._pool is None:
+            raise RuntimeError('Redis pool is not connected')
+        return self._pool
+
+    def in_use(self) -> int:
+        if self._pool is None:
+            return 0
+        # в очереди лежат свободные соединения и заглушки None под новые
+        return self._pool.max_connections - self._pool.pool.qsize()
+
+    def created(self) -> int:
+        if self._pool is None:
+            return 0
+        return len(self._pool._connections)
+
+    async def connect(self) -> None:
+        if self._pool is not None:
+            return
+
+        self._pool = aioredis.BlockingConnectionPool.from_url(
+            self.url,
+            max_connections=settings.redis_pool_max_size,
+            timeout=settings.redis_pool_timeout,
+            health_check_interval=settings.redis_health_check_interval,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_connect_timeout,
+        )
+
+    async def disconnect(self) -> None:
+        if self._pool is not None:
+            await self._pool.disconnect()
+        self._pool = None
+
+    def client(self) -> aioredis.Redis:
+        return aioredis.Redis(connection_pool=self.pool)
+
+
+# кэш картинок (может вытеснять ключи) и состояние входа (не должно)
+redis_pool = RedisPool(settings.redis_url)
+state_pool = (RedisPool(settings.redis_state_url)
+              if settings.redis_state_url else redis_pool)
+
+track(REDIS_POOL_CONNECTIONS.labels(state='in_use'), redis_pool.in_use)
+track(REDIS_POOL_CONNECTIONS.labels(state='created'), redis_pool.created)
+track(REDIS_POOL_CONNECTIONS.labels(state='max'),
+      lambda: settings.redis_pool_max_size)
 
 
 async def get_session() -> aioredis.Redis:
-    session = await aioredis.from_url(settings.redis_url)
-    yield session
+    # вне жизненного цикла приложения (например, в тестах) подключаемся лениво
+    if not redis_pool.is_connected:
+        await redis_pool.connect()
+    yield redis_pool.client()
+
+
+async def get_state_session() -> aioredis.Redis:
+    if not state_pool.is_connected:
+        await state_pool.connect()
+    yield state_pool.client()
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Optional
+
+from aioredis import Redis
+from aioredis.exceptions import RedisError
+from aioredis.exceptions import ResponseError
+
+from .connection import redis_pool
+from ..settings import settings
+from ..metrics import REDIS_MEMORY_BYTES
+
+
+class RedisMemoryMonitor:
+    """Выставляет бюджет памяти redis и периодически отчитывается о нем.
+
+    Политика вытеснения по умолчанию volatile-lru: вытесняются ключи
+    с TTL. TTL есть не только у картинок, но и у refresh-токенов, лимитов
+    входа и отрицательного кэша, поэтому вытеснение включается, только
+    если это состояние лежит в отдельном redis (redis_state_url).
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('main.redis_memory')
+        self._task: Optional[asyncio.Task] = None
+
+    async def configure(self, redis: Redis) -> None:
+        if not settings.redis_max_memory:
+            return
+        evicting = settings.redis_max_memory_policy != 'noeviction'
+        if evicting and not settings.redis_state_url:
+            # иначе под нагрузкой картинками вытеснялись бы refresh-токены
+            # (разлогинивая пользователей) и счетчики лимита входов
+            self.logger.warning(
+                'Redis memory budget is not set: eviction would drop '
+                'refresh tokens and rate limits, set REDIS_STATE_URL'
+            )
+            return
+
+        try:
+            await redis.config_set('maxmemory', settings.redis_max_memory)
+            await redis.config_set('maxmemory-policy',
+                                   settings.redis_max_memory_policy)
+        except ResponseError as exc:
+            # например, в управляемом redis CONFIG может быть запрещен
+            self.logger.info(f'Could not set redis memory budget: {exc}')
+
+    async def report(self, redis: Redis) -> None:
+        info = await redis.info('memory')
+        used = info.get('used_memory', 0)
+        budget = info.get('maxmemory', 0)
+
+        REDIS_MEMORY_BYTES.labels(kind='used').set(used)
+        REDIS_MEMORY_BYTES.labels(kind='max').set(budget)
+
+        if budget and used >= budget * settings.redis_memory_warn_ratio:
+            self.logger.warning(
+                f'Redis memory {used} bytes of {budget} bytes budget'
+            )
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        redis = redis_pool.client()
+        try:
+            await self.configure(redis)
+        except RedisError as exc:
+            self.logger.info(f'Could not configure redis memory: {exc}')
+
+        while True:
+            try:
+                await self.report(redis)
+            except RedisError as exc:
+                self.logger.info(f'Could not read redis memory info: {exc}')
+            await asyncio.sleep(settings.redis_memory_report_interval)
+
+
+redis_memory_monitor = RedisMemoryMonitor()
@@ -1,40 +1,85 @@
 import logging
 from datetime import datetime, timedelta
+from typing import NoReturn, Optional, Tuple, Union
 
+from aioredis import Redis
+from aioredis.exceptions import RedisError
+from asyncpg import PostgresError
 from asyncpg import UniqueViolationError
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from ormar import NoMatch
-from passlib.hash import bcrypt
 from fastapi import HTTPException
 from fastapi import Depends
 from fastapi import status
 from pydantic import ValidationError
 
+from .hashing import password_hasher
+from .prefetch import emoticon_prefetcher
+from .ratelimit import check_sign_in_rate
+from .ratelimit import sign_in_in_flight
+from .refresh import refresh_tokens
+from .usernames import username_filter
+from ..cache.tokens import token_cache
+from ..metrics import JWT_DECODE_SECONDS
+from ..metrics import SIGNIN_REJECTED
 from ..models.auth import User
 from ..models.auth import UserCreate
 from ..models.auth import Token
 from ..settings import settings
+from ..timing import hide_spans
+from ..timing import span
+from ..db import users as users_db
 from ..db.User import User as DBUser
+from ..redis.connection import get_state_session
 from ..constants import INCORRECT_USERNAME_OR_PASS_MESSAGE
 from ..constants import INCORRECT_TOKEN_MESSAGE
+from ..constants import PASSWORD_MIN_LENGTH
 
 
 class AuthService:
     @classmethod
     def validate_password(cls, password: str) -> bool:
-        return len(password) >= 4
+        return len(password) >= PASSWORD_MIN_LENGTH
 
     @classmethod
-    def verify_password(cls, password: str, hashed_password: str) -> bool:
-        return bcrypt.verify(password, hashed_password)
+    async def verify_password(cls,
+                              password: str,
+                              hashed_password: str) -> bool:
+        with span('bcrypt'):
+            return await password_hasher.verify(password, hashed_password)
 
     @classmethod
-    def hash_password(cls, password: str) -> str:
-        return bcrypt.hash(password)
+    async def verify_and_update_password(
+            cls,
+            password: str,
+            hashed_password: str,
+    ) -> Tuple[bool, Optional[str]]:
+        with span('bcrypt'):
+            return await password_hasher.verify_and_update(password,
+                                                           hashed_password)
+
+    @classmethod
+    async def hash_password(cls, password: str) -> str:
+        with span('bcrypt'):
+            return await password_hasher.hash(password)
+
+    @classmethod
+    def credentials_exception(cls) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=INCORRECT_USERNAME_OR_PASS_MESSAGE,
+            headers={
+                'WWW-Authenticate': 'Bearer',
+            },
+        )
 
     @classmethod
     def validate_token(cls, token: str) -> User:
+        key = token_cache.key(token)
+        user = token_cache.get(key)
+        if user is not None:
+            return user
+
         exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=INCORRECT_TOKEN_MESSAGE,
@@ -44,11 +89,12 @@ class AuthService:
         )
 
         try:
-            payload = jwt.decode(
-                token,
-                settings.jwt_secret,
-                algorithms=[settings.jwt_algorithm],
-            )
+            with span('token'), JWT_DECODE_SECONDS.time():
+                payload = jwt.decode(
+                    token,
+                    settings.jwt_secret,
+                    algorithms=[settings.jwt_algorithm],
+                )
         except JWTError:
             raise exception from None
 
@@ -59,10 +105,15 @@ class AuthService:
         except ValidationError:
             raise exception from None
 
+        if 'exp' in payload:
+            token_cache.put(key, user, payload['exp'])
         return user
 
     @classmethod
-    def create_token(cls, user: DBUser) -> Token:
+    def create_token(
+            cls,
+            user: Union[DBUser, users_db.UserCredentials, User],
+    ) -> Token:
         user_data = User.from_orm(user)
 
         now = datetime.utcnow()
@@ -82,7 +133,8 @@ class AuthService:
 
         return Token(access_token=token)
 
-    def __init__(self):
+    def __init__(self, redis: Redis = Depends(get_state_session)):
+        self.redis = redis
         self.logger = logging.getLogger('main.auth_service')
 
     async def register_new_user(self, user_data: UserCreate) -> Token:
@@ -94,43 +146,129 @@ class AuthService:
         if not self.validate_password(user_data.password):
             raise exception from None
 
+        # занятое имя отсекается до bcrypt; база проверяется, только если
+        # множество имен не уверено, что имени нет
+        with span('redis'):
+            known = await username_filter.contains(self.redis,
+                                                   user_data.username)
+        if known is not False:
+            with span('db'):
+                existing = await users_db.get_credentials(user_data.username)
+            if existing is not None:
+                self.logger.info('Username is already taken')
+                raise exception from None
+
+        password_hash = await self.hash_password(user_data.password)
         try:
-            user = await DBUser.objects.create(
-                username=user_data.username,
-                password_hash=self.hash_password(user_data.password)
-            )
+            with span('db'):
+                user = await users_db.create_user(user_data.username,
+                                                  password_hash)
         except UniqueViolationError:
             self.logger.info('Failed to save new user to database')
             raise exception from None
 
-        return self.create_token(user)
+        with span('redis'):
+            await username_filter.add(self.redis, user.username)
 
-    async def authenticate_user(self, username: str, password: str) -> Token:
-        exception = HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=INCORRECT_USERNAME_OR_PASS_MESSAGE,
-            headers={
-                'WWW-Authenticate': 'Bearer',
-            },
-        )
+        # первый запрос эмотикона не должен ждать сервис генерации
+        emoticon_prefetcher.submit(user.username)
+        return await self.issue_tokens(user)
 
-        try:
-            user = await DBUser.objects.get(username=username)
-        except NoMatch:
-            self.logger.info('Not found user by login-password')
-            raise exception from None
+    async def authenticate_user(self,
+                                username: str,
+                                password: str,
+                                client_ip: str) -> Token:
+        # по Server-Timing иначе видно, были ли поход в базу и bcrypt
+        hide_spans()
+
+        # перебор отсекается до похода в базу и bcrypt
+        with sign_in_in_flight.enter():
+            with span('redis'):
+                await check_sign_in_rate(self.redis, username, client_ip)
+                known = await username_filter.contains(self.redis, username)
+            if known is not False:
+                return await self.check_credentials(username, password)
 
-        if not self.verify_password(password, user.password_hash):
+        SIGNIN_REJECTED.labels(reason='unknown_user').inc()
+        await self.reject_unknown_user()
+
+    async def check_credentials(self, username: str, password: str) -> Token:
+        exception = self.credentials_exception()
+
+        with span('db'):
+            user = await users_db.get_credentials(username)
+        if user is None:
+            await self.reject_unknown_user()
+
+        valid, new_hash = await self.verify_and_update_password(
+            password, user.password_hash,
+        )
+        if not valid:
             self.logger.info(f"Didn't verify the pass of the user {username}")
             raise exception from None
 
-        print(username)
+        if new_hash is not None:
+            await self.upgrade_password_hash(user, new_hash)
+
         self.logger.info(f'User {username} is logged in')
-        return self.create_token(user)
+        return await self.issue_tokens(user)
+
+    async def reject_unknown_user(self) -> NoReturn:
+        """401 не быстрее, чем при неверном пароле существующего имени."""
+        self.logger.info('Not found user by login-password')
+        with span('bcrypt'):
+            await password_hasher.imitate_verify()
+        raise self.credentials_exception()
+
+    async def upgrade_password_hash(self,
+                                    user: users_db.UserCredentials,
+                                    new_hash: str) -> None:
+        """Сохраняет хэш по текущим настройкам (схема, число раундов)."""
+        try:
+            with span('db'):
+                await users_db.update_password_hash(user.id, new_hash)
+        except PostgresError as exc:
+            # не страшно: хэш обновится при следующем входе
+            self.logger.info(f'Password hash of {user.username} is not '
+                             f'upgraded: {exc!r}')
+            return
+        self.logger.info(f'Password hash of {user.username} is upgraded')
+
+    async def issue_tokens(
+            self,
+            user: Union[DBUser, users_db.UserCredentials],
+    ) -> Token:
+        token = self.create_token(user)
+        try:
+            with span('redis'):
+                token.refresh_token = await refresh_tokens.issue(
+                    self.redis, user.id, user.username,
+                )
+        except RedisError as exc:
+            # вход важнее: клиент получит только access-токен
+            self.logger.info(f'Refresh token is not issued: {exc!r}')
+        return token
+
+    async def refresh(self, refresh_token: str) -> Token:
+        with span('redis'):
+            rotated = await refresh_tokens.rotate(self.redis, refresh_token)
+        if rotated is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=INCORRECT_TOKEN_MESSAGE,
+                headers={
+                    'WWW-Authenticate': 'Bearer',
+                },
+            )
+
+        user, new_refresh_token = rotated
+        token = self.create_token(user)
+        token.refresh_token = new_refresh_token
+        return token
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/sign-in/')
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     return AuthService.validate_token(token)
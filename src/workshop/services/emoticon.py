@@ -1,31 +1,144 @@
-import io
+import asyncio
+import base64
+import hashlib
 import logging
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Dict, Iterable, List, Optional
+from typing import Set, Union
 
-from aiohttp import ClientSession, ClientConnectorError
+from aiohttp import ClientError
+from aiohttp import ClientResponse
+from aiohttp import ClientSession
 from aioredis import Redis
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+from aioredis.exceptions import RedisError
+from aioredis.exceptions import TimeoutError as RedisTimeoutError
 from fastapi import Depends, HTTPException
+from fastapi.responses import Response
 from fastapi.responses import StreamingResponse
 from fastapi import status
 
+from .singleflight import SingleFlight
+from .usernames import username_filter
+from ..models.emoticon import EmoticonBatch
+from ..cache.images import CachedImage
+from ..cache.images import image_cache
+from ..db import users as users_db
 from ..redis.connection import get_session as get_redis_session
-from ..constants import EMOTICON_SERVICE
+from ..upstream.balancer import emoticon_balancer
+from ..upstream.breaker import emoticon_breaker
+from ..upstream.connection import get_session as get_http_session
+from ..upstream.exceptions import CircuitOpenError
+from ..upstream.exceptions import UpstreamError
+from ..settings import settings
+from ..timing import span
+from ..metrics import EMOTICON_CACHE_REQUESTS
+from ..metrics import EMOTICON_COALESCED
+from ..metrics import EMOTICON_REFRESHES
+from ..metrics import EMOTICON_UPSTREAM_ERRORS
+from ..metrics import EMOTICON_UPSTREAM_FETCHES
+from ..metrics import EMOTICON_UPSTREAM_SECONDS
+from ..metrics import REDIS_COMMAND_SECONDS
 from ..constants import EMOTICON_POSTFIX
+from ..constants import EMOTICON_LOCK_POSTFIX
+from ..constants import EMOTICON_ETAG_POSTFIX
+from ..constants import EMOTICON_ERROR_POSTFIX
+from ..constants import EMOTICON_FORBIDDEN
+from ..constants import EMOTICON_NOT_FOUND
+from ..constants import EMOTICON_UNAVAILABLE
+from ..constants import PNG_SIGNATURE
+from ..constants import RELEASE_LOCK_SCRIPT
 
 
 class EmoticonService:
     _postfix = EMOTICON_POSTFIX
+    _lock_postfix = EMOTICON_LOCK_POSTFIX
+    _etag_postfix = EMOTICON_ETAG_POSTFIX
+    _error_postfix = EMOTICON_ERROR_POSTFIX
+    _flight = SingleFlight()
+    # ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+    _tasks: Set[asyncio.Task] = set()
+    # username, для которых уже идет фоновое обновление устаревшей картинки
+    _refreshing: Set[str] = set()
 
     @classmethod
-    def create_response(cls, image: bytes) -> StreamingResponse:
-        output = io.BytesIO(image)
-        return StreamingResponse(output, media_type='image/png')
+    def cache_headers(cls, etag: Optional[str] = None) -> dict:
+        visibility = 'public' if settings.emoticon_cache_public else 'private'
+        headers = {
+            'Cache-Control': (
+                f'{visibility}, max-age={settings.emoticon_cache_max_age}'
+            ),
+        }
+        if etag is not None:
+            headers['ETag'] = etag
+        return headers
 
     @classmethod
-    async def generate_emoticon(cls, username: str) -> bytes:
-        async with ClientSession() as session:
-            response = await session.get(f'{EMOTICON_SERVICE}/{username}')
-            emoticon_bytes = await response.read()
-            return emoticon_bytes
+    def create_response(cls, cached: CachedImage) -> Response:
+        # байты отдаются как есть, Content-Length выставит Response
+        return Response(cached.image,
+                        media_type='image/png',
+                        headers=cls.cache_headers(cached.etag))
+
+    @classmethod
+    def create_streaming_response(
+            cls,
+            response: ClientResponse,
+            queue: 'asyncio.Queue[Union[bytes, Exception, None]]',
+    ) -> StreamingResponse:
+        headers = cls.cache_headers()
+        if response.content_length is not None:
+            headers['Content-Length'] = str(response.content_length)
+        return StreamingResponse(cls._drain(queue),
+                                 media_type='image/png',
+                                 headers=headers)
+
+    @classmethod
+    async def _drain(
+            cls,
+            queue: 'asyncio.Queue[Union[bytes, Exception, None]]',
+    ) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    @classmethod
+    def create_not_modified_response(cls, etag: str) -> Response:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers=cls.cache_headers(etag))
+
+    @classmethod
+    def is_stale(cls, pttl: int) -> bool:
+        """Пора ли обновить картинку (по оставшемуся времени жизни ключа)."""
+        if pttl < 0:
+            return False
+        if settings.emoticon_hard_ttl <= 0 or settings.emoticon_soft_ttl <= 0:
+            return False
+        age = settings.emoticon_hard_ttl * 1000 - pttl
+        return age >= settings.emoticon_soft_ttl * 1000
+
+    @classmethod
+    def hard_ttl(cls) -> Optional[int]:
+        return settings.emoticon_hard_ttl or None
+
+    @classmethod
+    def make_etag(cls, image: bytes) -> str:
+        return f'"{hashlib.sha256(image).hexdigest()[:32]}"'
+
+    @classmethod
+    def parse_if_none_match(cls, header: str) -> List[str]:
+        # слабое сравнение (RFC 7232): префикс W/ не учитывается
+        return [tag.strip().replace('W/', '', 1) for tag in header.split(',')]
+
+    @classmethod
+    def etag_matches(cls, if_none_match: str, etag: str) -> bool:
+        tags = cls.parse_if_none_match(if_none_match)
+        return '*' in tags or etag in tags
 
     @classmethod
     async def validate_data(cls, token_username: str, url_username: str):
@@ -40,19 +153,483 @@ class EmoticonService:
         if token_username != url_username:
             raise exception
 
-    def __init__(self, redis: Redis = Depends(get_redis_session)):      # noqa
+    @classmethod
+    def is_allowed(cls, token_username: str, username: str) -> bool:
+        if settings.emoticon_batch_policy == 'any':
+            return True
+        return token_username == username
+
+    @classmethod
+    def validate_batch(cls, usernames: List[str]) -> None:
+        if len(usernames) > settings.emoticon_batch_max_size:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=(
+                    'Too many usernames, '
+                    f'max {settings.emoticon_batch_max_size}'
+                ),
+            )
+
+    def __init__(
+            self,
+            redis: Redis = Depends(get_redis_session),
+            http: ClientSession = Depends(get_http_session),
+    ):
         self.redis = redis
+        self.http = http
         self.logger = logging.getLogger('main.emoticon_services')
 
-    async def get_cache_image(self, username: str) -> bytes:
-        cache = await self.redis.get(username + self._postfix)
+    @classmethod
+    def remaining(cls, deadline: float) -> float:
+        return max(deadline - time.monotonic(), 0)
+
+    @classmethod
+    async def _read_head(cls, chunks: AsyncIterator[bytes]) -> bytes:
+        head = b''
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= len(PNG_SIGNATURE):
+                break
+        return head
+
+    async def recently_failed(self, username: str) -> bool:
+        with span('redis'):
+            failed = await self.redis.exists(username + self._error_postfix)
+        if failed:
+            EMOTICON_UPSTREAM_ERRORS.labels(reason='negative_cache').inc()
+            return True
+        return False
+
+    async def upstream_failed(self,
+                              username: str,
+                              reason: str,
+                              exc: Optional[BaseException] = None,
+                              ) -> UpstreamError:
+        """Учитывает ошибку сервиса и на время запоминает ее для username."""
+        EMOTICON_UPSTREAM_ERRORS.labels(reason=reason).inc()
+        emoticon_breaker.record_failure()
+        self.logger.info(f'Emoticon service failed for {username}: '
+                         f'{reason} {exc or ""}')
+        try:
+            await self.redis.set(
+                username + self._error_postfix,
+                reason,
+                px=int(settings.emoticon_negative_ttl * 1000),
+            )
+        except RedisError:
+            pass
+        return UpstreamError(reason)
+
+    async def open_upstream(self,
+                            username: str,
+                            deadline: float) -> ClientResponse:
+        if not emoticon_breaker.allow():
+            EMOTICON_UPSTREAM_ERRORS.labels(reason='circuit_open').inc()
+            raise CircuitOpenError('circuit_open')
+
+        EMOTICON_UPSTREAM_FETCHES.inc()
+        try:
+            with span('upstream'), EMOTICON_UPSTREAM_SECONDS.time():
+                response = await emoticon_balancer.get(
+                    self.http,
+                    username,
+                    self.remaining(deadline),
+                )
+        except asyncio.TimeoutError as exc:
+            raise await self.upstream_failed(username, 'timeout', exc)
+        except ClientError as exc:
+            raise await self.upstream_failed(username, 'connection', exc)
+
+        if response.status != status.HTTP_200_OK:
+            response.release()
+            raise await self.upstream_failed(username, 'status',
+                                             response.status)
+        return response
+
+    async def generate_emoticon(self, username: str) -> bytes:
+        deadline = time.monotonic() + settings.emoticon_deadline
+        response = await self.open_upstream(username, deadline)
+        try:
+            with span('upstream'):
+                emoticon_bytes = await asyncio.wait_for(
+                    response.read(),
+                    self.remaining(deadline),
+                )
+        except asyncio.TimeoutError as exc:
+            raise await self.upstream_failed(username, 'timeout', exc)
+        except ClientError as exc:
+            raise await self.upstream_failed(username, 'connection', exc)
+
+        if not emoticon_bytes.startswith(PNG_SIGNATURE):
+            raise await self.upstream_failed(username, 'body')
+
+        emoticon_breaker.record_success()
+        return emoticon_bytes
+
+    async def get_cache_etag(self, username: str) -> Optional[str]:
+        cached = image_cache.get(username)
+        if cached is not None:
+            return cached.etag
+
+        try:
+            with span('redis'), \
+                    REDIS_COMMAND_SECONDS.labels(command='get').time():
+                etag = await self.redis.get(username + self._etag_postfix)
+        except (RedisConnectionError, RedisTimeoutError):
+            # повторные просмотры приходят с If-None-Match: без redis
+            # отвечаем по устаревшей копии, как и get_cache_images
+            stale = image_cache.get_stale(username)
+            if stale is None:
+                raise
+            self.logger.info(f'Redis is unavailable, stale etag {username}')
+            return stale.etag
+        return etag.decode() if etag is not None else None
+
+    async def get_cache_images(
+            self,
+            usernames: Iterable[str],
+    ) -> Dict[str, CachedImage]:
+        """Картинки из кэша: сначала L1, остальные - одним MGET из redis."""
+        found = {}
+        missing = []
+        for username in usernames:
+            cached = image_cache.get(username)
+            if cached is not None:
+                found[username] = cached
+            else:
+                missing.append(username)
+
+        if not missing:
+            return found
+
+        keys = []
+        for username in missing:
+            keys += [username + self._postfix, username + self._etag_postfix]
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.mget(keys)
+                for username in missing:
+                    pipe.pttl(username + self._postfix)
+                with span('redis'), \
+                        REDIS_COMMAND_SECONDS.labels(command='get').time():
+                    values, *ttls = await pipe.execute()
+        except (RedisConnectionError, RedisTimeoutError):
+            stale = {username: image_cache.get_stale(username)
+                     for username in missing}
+            if None in stale.values():
+                raise
+            self.logger.info(f'Redis is unavailable, stale images {missing}')
+            return {**found, **stale}
+
+        backfill = {}
+        expire = []
+        rows = zip(missing, values[::2], values[1::2], ttls)
+        for username, image, etag, pttl in rows:
+            if image is None:
+                EMOTICON_CACHE_REQUESTS.labels(result='miss').inc()
+                continue
+            EMOTICON_CACHE_REQUESTS.labels(result='hit').inc()
+
+            if pttl == -1 and self.hard_ttl():
+                # картинка сохранена без TTL (до его появления)
+                expire.append(username)
+            elif self.is_stale(pttl):
+                self.schedule_refresh(username)
+
+            if etag is None:
+                # картинка сохранена без etag (например, до его появления)
+                etag = self.make_etag(image)
+                backfill[username + self._etag_postfix] = etag
+            else:
+                etag = etag.decode()
+
+            cached = CachedImage(image, etag)
+            image_cache.put(username, cached)
+            found[username] = cached
+
+        if backfill or expire:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, etag in backfill.items():
+                    pipe.set(key, etag, nx=True, ex=self.hard_ttl())
+                for username in expire:
+                    pipe.expire(username + self._postfix, self.hard_ttl())
+                    pipe.expire(username + self._etag_postfix,
+                                self.hard_ttl())
+                with span('redis'):
+                    await pipe.execute()
+
+        return found
+
+    async def get_cache_image(self, username: str) -> Optional[CachedImage]:
+        return (await self.get_cache_images((username,))).get(username)
+
+    async def save_images_to_redis(
+            self,
+            images: Dict[str, bytes],
+    ) -> Dict[str, CachedImage]:
+        saved = {username: CachedImage(image, self.make_etag(image))
+                 for username, image in images.items()}
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for username, cached in saved.items():
+                pipe.set(username + self._postfix,
+                         cached.image,
+                         ex=self.hard_ttl())
+                pipe.set(username + self._etag_postfix,
+                         cached.etag,
+                         ex=self.hard_ttl())
+            with span('redis'), \
+                    REDIS_COMMAND_SECONDS.labels(command='set').time():
+                await pipe.execute()
+
+        for username, cached in saved.items():
+            image_cache.put(username, cached)
+        return saved
+
+    async def save_image_to_redis(self,
+                                  image: bytes,
+                                  username: str) -> CachedImage:
+        saved = await self.save_images_to_redis({username: image})
+        return saved[username]
+
+    async def _acquire_lock(self, username: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        with span('redis'):
+            acquired = await self.redis.set(
+                username + self._lock_postfix,
+                token,
+                nx=True,
+                px=int(settings.emoticon_lock_ttl * 1000),
+            )
+        return token if acquired else None
+
+    async def _release_lock(self, username: str, token: str) -> None:
+        with span('redis'):
+            await self.redis.eval(
+                RELEASE_LOCK_SCRIPT, 1, username + self._lock_postfix, token,
+            )
+
+    async def _acquire_locks(
+            self,
+            usernames: Iterable[str],
+    ) -> Dict[str, Optional[str]]:
+        """Как _acquire_lock, но для пачки имен одним запросом к redis."""
+        tokens = {username: uuid.uuid4().hex for username in usernames}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for username, token in tokens.items():
+                pipe.set(username + self._lock_postfix,
+                         token,
+                         nx=True,
+                         px=int(settings.emoticon_lock_ttl * 1000))
+            with span('redis'):
+                acquired = await pipe.execute()
+        return {username: token if locked else None
+                for (username, token), locked in zip(tokens.items(),
+                                                     acquired)}
+
+    async def _release_locks(self, tokens: Dict[str, str]) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for username, token in tokens.items():
+                pipe.eval(RELEASE_LOCK_SCRIPT, 1,
+                          username + self._lock_postfix, token)
+            with span('redis'):
+                await pipe.execute()
 
-        return cache
+    async def _wait_for_image(self,
+                              username: str) -> Optional[CachedImage]:
+        """Ждет, пока другой воркер положит картинку в redis.
 
-    async def save_image_to_redis(self, image: bytes, username: str) -> None:
-        await self.redis.set(username + self._postfix, image)
+        Возвращает None, если блокировка пропала (или истекло время
+        ожидания), а картинка так и не появилась.
+        """
+        deadline = time.monotonic() + settings.emoticon_lock_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.emoticon_lock_poll_interval)
+            cached = await self.get_cache_image(username)
+            if cached is not None:
+                return cached
+            if not await self.redis.exists(username + self._lock_postfix):
+                return await self.get_cache_image(username)
+        return None
 
-    async def get_user_emoticon(self, username: str) -> StreamingResponse:
+    async def fetch_emoticon(self, username: str) -> CachedImage:
+        """Один запрос к сервису эмотиконов на username на все воркеры."""
+        if await self.recently_failed(username):
+            raise UpstreamError('negative_cache')
+
+        token = await self._acquire_lock(username)
+        if token is None:
+            with span('lock_wait'):
+                cached = await self._wait_for_image(username)
+            if cached is not None:
+                EMOTICON_COALESCED.labels(scope='remote').inc()
+                return cached
+            self.logger.info(f'Lock wait for {username} expired')
+
+        try:
+            image = await self.generate_emoticon(username)
+            cached = await self.save_image_to_redis(image, username)
+        finally:
+            if token is not None:
+                await self._release_lock(username, token)
+
+        return cached
+
+    async def prefetch(self, username: str) -> bool:
+        """Заранее кладет картинку в кэш; False, если она уже там.
+
+        Одновременный запрос той же картинки дождется этой загрузки.
+        """
+        if await self.get_cache_image(username) is not None:
+            return False
+        await self._flight.do(username,
+                              lambda: self.fetch_emoticon(username))
+        return True
+
+    async def refresh_emoticon(self, username: str) -> None:
+        """Обновляет картинку, если этого уже не делает другой воркер."""
+        token = await self._acquire_lock(username)
+        if token is None:
+            return
+
+        try:
+            image = await self.generate_emoticon(username)
+            await self.save_image_to_redis(image, username)
+            EMOTICON_REFRESHES.labels(result='done').inc()
+        finally:
+            await self._release_lock(username, token)
+
+    async def _refresh(self, username: str) -> None:
+        try:
+            await self.refresh_emoticon(username)
+        except Exception as exc:
+            EMOTICON_REFRESHES.labels(result='failed').inc()
+            self.logger.info(f'Failed to refresh emoticon {username}: {exc}')
+        finally:
+            self._refreshing.discard(username)
+
+    def schedule_refresh(self, username: str) -> None:
+        """stale-while-revalidate: обновляет устаревшую картинку в фоне.
+
+        Запрос сразу получает то, что лежит в кэше; обновление идет не
+        больше одного на username.
+        """
+        if username in self._refreshing or self._flight.in_flight(username):
+            return
+        if len(self._refreshing) >= settings.emoticon_refresh_concurrency:
+            EMOTICON_REFRESHES.labels(result='skipped').inc()
+            return
+
+        self._refreshing.add(username)
+        self._spawn(self._refresh(username))
+
+    def _spawn(self, coro: Awaitable[None]) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _tee(
+            self,
+            username: str,
+            response: ClientResponse,
+            head: bytes,
+            chunks: AsyncIterator[bytes],
+            token: Optional[str],
+            future: asyncio.Future,
+            queue: 'asyncio.Queue[Union[bytes, Exception, None]]',
+    ) -> None:
+        """Читает ответ сервиса: куски уходят клиенту, целиком - в redis.
+
+        Работает отдельной задачей, поэтому картинка сохранится, даже
+        если клиент отключится, не дочитав ответ.
+        """
+        image = [head]
+        queue.put_nowait(head)
+        try:
+            async for chunk in chunks:
+                image.append(chunk)
+                queue.put_nowait(chunk)
+            cached = await self.save_image_to_redis(b''.join(image),
+                                                    username)
+        except Exception as exc:
+            self.logger.info(f'Failed to stream emoticon {username}: {exc}')
+            queue.put_nowait(exc)
+            self._flight.reject(username, future, exc)
+        except BaseException as exc:
+            # задачу отменили (например, при остановке): ни клиент, ни
+            # ждущие того же username не должны зависнуть
+            queue.put_nowait(UpstreamError('cancelled'))
+            self._flight.reject(username, future, exc)
+            raise
+        else:
+            queue.put_nowait(None)
+            self._flight.resolve(username, future, cached)
+        finally:
+            response.release()
+            if token is not None:
+                await self._release_lock(username, token)
+
+    async def stream_emoticon(self, username: str) -> Response:
+        """Промах кэша: отдаем ответ сервиса по мере получения.
+
+        Остальные запросы за тем же username в этом воркере ждут
+        результат ведущего, в других воркерах - картинку в redis.
+        """
+        future = self._flight.lead(username)
+        token = None
+        response = None
+        try:
+            if await self.recently_failed(username):
+                raise UpstreamError('negative_cache')
+
+            token = await self._acquire_lock(username)
+            if token is None:
+                with span('lock_wait'):
+                    cached = await self._wait_for_image(username)
+                if cached is not None:
+                    EMOTICON_COALESCED.labels(scope='remote').inc()
+                    self._flight.resolve(username, future, cached)
+                    return self.create_response(cached)
+                self.logger.info(f'Lock wait for {username} expired')
+
+            deadline = time.monotonic() + settings.emoticon_deadline
+            response = await self.open_upstream(username, deadline)
+
+            # до ответа клиенту убеждаемся, что сервис прислал PNG
+            chunks = response.content.iter_chunked(
+                settings.emoticon_stream_chunk_size,
+            )
+            try:
+                head = await asyncio.wait_for(self._read_head(chunks),
+                                              self.remaining(deadline))
+            except asyncio.TimeoutError as exc:
+                raise await self.upstream_failed(username, 'timeout', exc)
+            except ClientError as exc:
+                raise await self.upstream_failed(username, 'connection', exc)
+            if not head.startswith(PNG_SIGNATURE):
+                raise await self.upstream_failed(username, 'body')
+            emoticon_breaker.record_success()
+        except BaseException as exc:
+            self._flight.reject(username, future, exc)
+            if response is not None:
+                response.release()
+            if token is not None:
+                await self._release_lock(username, token)
+            raise
+
+        queue = asyncio.Queue()
+        self._spawn(self._tee(username, response, head, chunks, token,
+                              future, queue))
+
+        return self.create_streaming_response(response, queue)
+
+    async def get_user_emoticon(
+            self,
+            username: str,
+            if_none_match: Optional[str] = None,
+    ) -> Response:
         exception = HTTPException(
             status_code=status.HTTP_423_LOCKED,
             detail='Service is not accessed',
@@ -61,12 +638,171 @@ class EmoticonService:
             },
         )
 
-        image: bytes = await self.get_cache_image(username)
-        if image is None:
-            try:
-                image = await self.generate_emoticon(username)
-            except ClientConnectorError:
+        if if_none_match:
+            etag = await self.get_cache_etag(username)
+            if etag is not None and self.etag_matches(if_none_match, etag):
+                return self.create_not_modified_response(etag)
+
+        cached = await self.get_cache_image(username)
+        if cached is not None:
+            return self.create_response(cached)
+
+        future = self._flight.join(username)
+        try:
+            if future is None:
+                return await self.stream_emoticon(username)
+
+            EMOTICON_COALESCED.labels(scope='local').inc()
+            cached = await self._flight.wait(future)
+        except (UpstreamError, ClientError, asyncio.TimeoutError):
+            raise exception
+        except asyncio.CancelledError:
+            # отменен ведущий запрос, а не этот
+            if future is not None and future.cancelled():
                 raise exception
-            await self.save_image_to_redis(image, username)
+            raise
+
+        return self.create_response(cached)
+
+    async def fetch_emoticons(
+            self,
+            usernames: List[str],
+    ) -> Dict[str, CachedImage]:
+        """Забирает картинки у сервиса с ограниченной конкурентностью.
+
+        Запросы, которые уже выполняются в этом или другом воркере (под
+        той же блокировкой в redis, что и у fetch_emoticon), не
+        повторяются. Новые картинки сохраняются в redis одной пачкой.
+        """
+        semaphore = asyncio.Semaphore(settings.emoticon_batch_concurrency)
+        joined = {}
+        led = {}
+        with span('redis'):
+            failed = await self.redis.mget(
+                [username + self._error_postfix for username in usernames],
+            )
+        for username, error in zip(usernames, failed):
+            if error is not None:
+                EMOTICON_UPSTREAM_ERRORS.labels(reason='negative_cache').inc()
+                continue
+
+            future = self._flight.join(username)
+            if future is not None:
+                EMOTICON_COALESCED.labels(scope='local').inc()
+                joined[username] = future
+            else:
+                led[username] = self._flight.lead(username)
+
+        tokens: Dict[str, Optional[str]] = {}
+
+        async def generate(username: str) -> Union[bytes, CachedImage]:
+            if tokens[username] is None:
+                with span('lock_wait'):
+                    cached = await self._wait_for_image(username)
+                if cached is not None:
+                    EMOTICON_COALESCED.labels(scope='remote').inc()
+                    return cached
+                self.logger.info(f'Lock wait for {username} expired')
+
+            async with semaphore:
+                return await self.generate_emoticon(username)
+
+        try:
+            if led:
+                tokens = await self._acquire_locks(led)
+            results = await asyncio.gather(
+                *(generate(username) for username in led),
+                return_exceptions=True,
+            )
+
+            images = {}
+            remote = {}
+            for username, result in zip(led, results):
+                if isinstance(result, BaseException):
+                    self.logger.info(f'Failed to fetch {username}: {result}')
+                    self._flight.reject(username, led[username], result)
+                elif isinstance(result, CachedImage):
+                    remote[username] = result
+                else:
+                    images[username] = result
+
+            saved = await self.save_images_to_redis(images) if images else {}
+            saved.update(remote)
+        except BaseException as exc:
+            # как в SingleFlight.do: ждущие не должны зависнуть, даже если
+            # запрос отменили посреди gather
+            for username, future in led.items():
+                self._flight.reject(username, future, exc)
+            raise
+        finally:
+            # после записи: ждущие воркеры сразу найдут картинку
+            owned = {username: token for username, token in tokens.items()
+                     if token is not None}
+            if owned:
+                await self._release_locks(owned)
+
+        for username, cached in saved.items():
+            self._flight.resolve(username, led[username], cached)
+
+        for username, future in joined.items():
+            try:
+                saved[username] = await self._flight.wait(future)
+            except Exception as exc:
+                self.logger.info(f'Failed to fetch {username}: {exc}')
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                self.logger.info(f'Fetch of {username} was cancelled')
+
+        return saved
+
+    @staticmethod
+    async def existing_usernames(state_redis: Redis,
+                                 usernames: List[str]) -> Set[str]:
+        with span('redis'):
+            found = await username_filter.existing(state_redis, usernames)
+        if found is None:
+            with span('db'):
+                found = await users_db.existing_usernames(usernames)
+        return found
+
+    async def get_batch(self,
+                        token_username: str,
+                        usernames: List[str],
+                        state_redis: Redis) -> EmoticonBatch:
+        self.validate_batch(usernames)
+
+        usernames = list(dict.fromkeys(usernames))
+        errors = {username: EMOTICON_FORBIDDEN for username in usernames
+                  if not self.is_allowed(token_username, username)}
+        allowed = [username for username in usernames
+                   if username not in errors]
+
+        found = await self.get_cache_images(allowed)
+        missing = [username for username in allowed if username not in found]
+
+        # произвольные имена не должны превращаться в запросы к сервису
+        # генерации и записи в кэш: свое имя существует заведомо
+        others = [username for username in missing
+                  if username != token_username]
+        if others:
+            existing = await self.existing_usernames(state_redis, others)
+            for username in others:
+                if username not in existing:
+                    errors[username] = EMOTICON_NOT_FOUND
+            missing = [username for username in missing
+                       if username not in errors]
+
+        if missing:
+            found.update(await self.fetch_emoticons(missing))
+
+        for username in missing:
+            if username not in found:
+                errors[username] = EMOTICON_UNAVAILABLE
 
-        return self.create_response(image)
+        images = {
+            username: (base64.b64encode(found[username].image).decode()
+                       if username in found else None)
+            for username in usernames
+        }
+        return EmoticonBatch(images=images, errors=errors)
@@ -0,0 +1,173 @@
+import asyncio
+import secrets
+import time
+from contextlib import contextmanager
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException
+from fastapi import status
+from passlib.context import CryptContext
+
+from ..settings import settings
+from ..metrics import PASSWORD_HASH_PENDING
+from ..metrics import PASSWORD_HASH_QUEUE_SECONDS
+from ..metrics import PASSWORD_HASH_REJECTED
+from ..metrics import PASSWORD_HASH_SECONDS
+from ..constants import SERVICE_BUSY_MESSAGE
+
+
+T = TypeVar('T')
+
+
+def create_context() -> CryptContext:
+    """Первая схема - для новых хэшей, остальные только проверяются.
+
+    min_rounds равен настроенному числу раундов, поэтому хэш с меньшим
+    числом раундов (или старой схемы) считается устаревшим.
+    """
+    rounds = {}
+    for scheme, value in settings.password_rounds.items():
+        rounds[f'{scheme}__default_rounds'] = value
+        rounds[f'{scheme}__min_rounds'] = value
+    return CryptContext(schemes=settings.password_schemes,
+                        deprecated='auto',
+                        **rounds)
+
+
+# создается и в процессах ProcessPoolExecutor при импорте модуля
+context = create_context()
+
+
+# функции уровня модуля, чтобы их можно было передать в ProcessPoolExecutor
+def _hash(password: str) -> str:
+    return context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return context.verify(password, hashed_password)
+
+
+def _verify_and_update(password: str,
+                       hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return context.verify_and_update(password, hashed_password)
+
+
+def _timed_call(fn: Callable[..., T],
+                submitted: float,
+                *args) -> Tuple[T, float, float]:
+    # time.monotonic системный, поэтому сравним и между процессами
+    started = time.monotonic()
+    result = fn(*args)
+    return result, started - submitted, time.monotonic() - started
+
+
+class PasswordHasher:
+    """Выполняет bcrypt в отдельном пуле, не блокируя event loop.
+
+    Число задач в очереди ограничено: при переполнении запрос сразу
+    получает 503, а не ждет в хвосте очереди.
+    """
+
+    # вес нового замера в скользящем среднем времени операции
+    EWMA_WEIGHT = 0.1
+
+    def __init__(self):
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._expected: Optional[float] = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+
+        if settings.password_hash_executor == 'process':
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.password_hash_workers,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.password_hash_workers,
+                thread_name_prefix='password-hasher',
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    async def hash(self, password: str) -> str:
+        return await self._run('hash', _hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run('verify', _verify, password, hashed_password)
+
+    async def verify_and_update(
+            self,
+            password: str,
+            hashed_password: str,
+    ) -> Tuple[bool, Optional[str]]:
+        """Проверка пароля и новый хэш, если старый устарел."""
+        return await self._run('verify', _verify_and_update,
+                               password, hashed_password)
+
+    async def imitate_verify(self) -> None:
+        """Занимает столько же времени, сколько обычно проверка пароля.
+
+        Нужна там, где пароль проверять не с чем (имени нет), чтобы по
+        времени ответа нельзя было понять, существует ли пользователь.
+        """
+        if self._expected is None:
+            # замеров еще нет: честно считаем хэш случайной строки
+            await self.hash(secrets.token_hex(16))
+            return
+        # иначе по 503 под нагрузкой было бы видно, что имени нет
+        with self._slot('verify'):
+            await asyncio.sleep(self._expected)
+
+    @contextmanager
+    def _slot(self, operation: str) -> Iterator[None]:
+        if self._pending >= settings.password_hash_queue_limit:
+            PASSWORD_HASH_REJECTED.labels(operation=operation).inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=SERVICE_BUSY_MESSAGE,
+                headers={'Retry-After': '1'},
+            )
+
+        self._pending += 1
+        PASSWORD_HASH_PENDING.inc()
+        try:
+            yield
+        finally:
+            self._pending -= 1
+            PASSWORD_HASH_PENDING.dec()
+
+    async def _run(self, operation: str, fn: Callable[..., T], *args) -> T:
+        with self._slot(operation):
+            self.start()
+            loop = asyncio.get_running_loop()
+            result, waited, duration = await loop.run_in_executor(
+                self._executor, _timed_call, fn, time.monotonic(), *args,
+            )
+
+        PASSWORD_HASH_QUEUE_SECONDS.labels(operation=operation).observe(waited)
+        PASSWORD_HASH_SECONDS.labels(operation=operation).observe(duration)
+
+        # хэширование и проверка стоят одинаково, ожидание в очереди
+        # тоже видно клиенту
+        elapsed = waited + duration
+        if self._expected is None:
+            self._expected = elapsed
+        else:
+            self._expected += self.EWMA_WEIGHT * (elapsed - self._expected)
+        return result
+
+
+password_hasher = PasswordHasher()
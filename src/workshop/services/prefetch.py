@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from .emoticon import EmoticonService
+from ..redis.connection import redis_pool
+from ..upstream.connection import http_client
+from ..settings import settings
+from ..metrics import EMOTICON_PREFETCH
+from ..metrics import EMOTICON_PREFETCH_QUEUE
+from ..metrics import track
+
+
+class EmoticonPrefetcher:
+    """Фоновая генерация эмотиконов (например, сразу после регистрации).
+
+    Очередь ограничена: если она заполнена, задача отбрасывается,
+    а не тормозит запрос, который ее поставил.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('main.emoticon_prefetcher')
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self) -> None:
+        if self.is_running or not settings.emoticon_prefetch_enabled:
+            return
+
+        self._queue = asyncio.Queue(settings.emoticon_prefetch_queue_size)
+        self._workers = [
+            asyncio.create_task(self._work())
+            for _ in range(settings.emoticon_prefetch_workers)
+        ]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def submit(self, username: str) -> bool:
+        if not self.is_running:
+            return False
+
+        try:
+            self._queue.put_nowait(username)
+        except asyncio.QueueFull:
+            EMOTICON_PREFETCH.labels(result='dropped').inc()
+            return False
+
+        EMOTICON_PREFETCH.labels(result='queued').inc()
+        return True
+
+    async def prefetch(self, username: str) -> None:
+        service = EmoticonService(redis_pool.client(), http_client.session)
+        if not await service.prefetch(username):
+            EMOTICON_PREFETCH.labels(result='skipped').inc()
+            return
+        EMOTICON_PREFETCH.labels(result='done').inc()
+
+    async def _work(self) -> None:
+        while True:
+            username = await self._queue.get()
+            try:
+                await self.prefetch(username)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                EMOTICON_PREFETCH.labels(result='failed').inc()
+                self.logger.info(f'Failed to prefetch {username}: {exc}')
+            finally:
+                self._queue.task_done()
+
+
+emoticon_prefetcher = EmoticonPrefetcher()
+track(EMOTICON_PREFETCH_QUEUE, emoticon_prefetcher.qsize)
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import math
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Sequence, Tuple
+
+from aioredis import Redis
+from aioredis.exceptions import NoScriptError
+from aioredis.exceptions import RedisError
+from fastapi import HTTPException
+from fastapi import status
+
+from ..constants import SERVICE_BUSY_MESSAGE
+from ..constants import SIGNIN_IP_PREFIX
+from ..constants import SIGNIN_USERNAME_PREFIX
+from ..constants import TOO_MANY_ATTEMPTS_MESSAGE
+from ..metrics import SIGNIN_REJECTED
+from ..settings import settings
+
+
+# Скользящее окно как журнал попыток в sorted set (score - время в мс).
+# KEYS - ключи ограничений, ARGV: id попытки, затем пары лимит/окно (мс)
+# для каждого ключа. Попытка записывается во все ключи, только если ни
+# один лимит не исчерпан; иначе возвращается, через сколько мс
+# освободится место. Время берется у redis, чтобы часы воркеров
+# не расходились.
+SLIDING_WINDOW_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local retry = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2])
+    local window = tonumber(ARGV[i * 2 + 1])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        retry = math.max(retry, tonumber(oldest[2]) + window - now)
+    end
+end
+if retry > 0 then
+    return retry
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[1])
+    redis.call('PEXPIRE', key, ARGV[i * 2 + 1])
+end
+return 0
+"""
+SLIDING_WINDOW_SHA = hashlib.sha1(SLIDING_WINDOW_SCRIPT.encode()).hexdigest()
+
+
+class SlidingWindowLimiter:
+    """Несколько ограничений частоты за один запрос к redis.
+
+    Если redis недоступен, запрос пропускается: вход важнее защиты.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('main.rate_limit')
+
+    async def hit(self,
+                  redis: Redis,
+                  limits: Sequence[Tuple[str, int, float]]) -> float:
+        """Учитывает попытку; limits - (ключ, лимит, окно в секундах).
+
+        Возвращает 0, если попытка разрешена, иначе через сколько секунд
+        стоит повторить.
+        """
+        keys = [key for key, _, _ in limits]
+        args = [uuid.uuid4().hex]
+        for _, limit, window in limits:
+            args += [limit, int(window * 1000)]
+
+        try:
+            try:
+                retry = await redis.evalsha(SLIDING_WINDOW_SHA, len(keys),
+                                            *keys, *args)
+            except NoScriptError:
+                retry = await redis.eval(SLIDING_WINDOW_SCRIPT, len(keys),
+                                         *keys, *args)
+        except RedisError as exc:
+            self.logger.info(f'Rate limit is not checked: {exc!r}')
+            return 0.0
+        return retry / 1000
+
+
+class InFlightLimit:
+    """Ограничение числа одновременных операций в воркере.
+
+    Сверх лимита запрос сразу получает 503, а не ждет в очереди.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+
+    @contextmanager
+    def enter(self) -> Iterator[None]:
+        if self.in_flight >= self.limit:
+            SIGNIN_REJECTED.labels(reason='concurrency').inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=SERVICE_BUSY_MESSAGE,
+                headers={'Retry-After': '1'},
+            )
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+
+sign_in_limiter = SlidingWindowLimiter()
+sign_in_in_flight = InFlightLimit(settings.signin_max_in_flight)
+
+
+async def check_sign_in_rate(redis: Redis,
+                             username: str,
+                             client_ip: str) -> None:
+    """429 с Retry-After, если с имени или адреса слишком много попыток."""
+    if not settings.signin_rate_limit_enabled:
+        return
+
+    retry = await sign_in_limiter.hit(redis, (
+        (SIGNIN_USERNAME_PREFIX + username,
+         settings.signin_username_limit,
+         settings.signin_username_window),
+        (SIGNIN_IP_PREFIX + client_ip,
+         settings.signin_ip_limit,
+         settings.signin_ip_window),
+    ))
+    if retry:
+        SIGNIN_REJECTED.labels(reason='rate_limit').inc()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=TOO_MANY_ATTEMPTS_MESSAGE,
+            headers={'Retry-After': str(math.ceil(retry))},
+        )
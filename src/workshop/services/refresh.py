@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import secrets
+from typing import Optional, Tuple
+
+from aioredis import Redis
+from aioredis.exceptions import NoScriptError
+
+from ..constants import REFRESH_FAMILY_PREFIX
+from ..models.auth import User
+from ..settings import settings
+
+
+# Семейство - цепочка refresh-токенов одного входа. В хэше семейства
+# лежит пользователь и sha256 текущего токена. Обмен токена - один вызов:
+# текущий токен заменяется новым; предъявление старого (уже обменянного)
+# токена значит, что его украли, и семейство удаляется целиком.
+# Возвращает {1, id, username}, {0} - семейства нет, {-1} - повтор.
+ROTATE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'current')
+if not current then
+    return {0}
+end
+if current ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return {-1}
+end
+redis.call('HSET', KEYS[1], 'current', ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+local user = redis.call('HMGET', KEYS[1], 'user_id', 'username')
+return {1, user[1], user[2]}
+"""
+ROTATE_SHA = hashlib.sha1(ROTATE_SCRIPT.encode()).hexdigest()
+
+
+def _digest(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+class RefreshTokenStore:
+    """Ротируемые refresh-токены в redis с обнаружением повторов.
+
+    Токен - "<семейство>.<секрет>", в redis хранится только хэш секрета.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('main.refresh_tokens')
+
+    @staticmethod
+    def _ttl_ms() -> int:
+        return settings.refresh_token_ttl * 1000
+
+    async def issue(self, redis: Redis, user_id: int, username: str) -> str:
+        family = secrets.token_urlsafe(16)
+        secret = secrets.token_urlsafe(32)
+        key = REFRESH_FAMILY_PREFIX + family
+
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={
+                'user_id': user_id,
+                'username': username,
+                'current': _digest(secret),
+            })
+            pipe.pexpire(key, self._ttl_ms())
+            await pipe.execute()
+        return f'{family}.{secret}'
+
+    async def rotate(self,
+                     redis: Redis,
+                     token: str) -> Optional[Tuple[User, str]]:
+        """Меняет токен на новый; None, если токен недействителен."""
+        family, _, secret = token.partition('.')
+        if not family or not secret:
+            return None
+
+        new_secret = secrets.token_urlsafe(32)
+        keys = (REFRESH_FAMILY_PREFIX + family,)
+        args = (_digest(secret), _digest(new_secret), self._ttl_ms())
+        try:
+            result = await redis.evalsha(ROTATE_SHA, 1, *keys, *args)
+        except NoScriptError:
+            result = await redis.eval(ROTATE_SCRIPT, 1, *keys, *args)
+
+        if result[0] == -1:
+            self.logger.warning(f'Refresh token reuse, family {family} '
+                                f'is revoked')
+        if result[0] != 1:
+            return None
+
+        user = User(id=int(result[1]), username=result[2].decode())
+        return user, f'{family}.{new_secret}'
+
+
+refresh_tokens = RefreshTokenStore()
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """Выполняет не больше одного вызова на ключ в рамках процесса.
+
+    Пока вызов для ключа выполняется, остальные вызывающие ждут
+    его результат (или исключение) вместо того, чтобы запускать свой.
+    Помимо do() ведущего можно вести вручную: lead() -> resolve()/reject(),
+    если результат появится уже после выхода из обработчика запроса.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Future] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    def join(self, key: str) -> Optional[asyncio.Future]:
+        return self._flights.get(key)
+
+    def lead(self, key: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._consume)
+        self._flights[key] = future
+        return future
+
+    def resolve(self, key: str, future: asyncio.Future, result: Any) -> None:
+        if not future.done():
+            future.set_result(result)
+        self._forget(key, future)
+
+    def reject(self,
+               key: str,
+               future: asyncio.Future,
+               exc: BaseException) -> None:
+        if not future.done():
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+        self._forget(key, future)
+
+    async def wait(self, future: asyncio.Future) -> Any:
+        # shield: отмена одного ожидающего не должна отменять остальных
+        return await asyncio.shield(future)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        future = self.join(key)
+        if future is not None:
+            return await self.wait(future)
+
+        future = self.lead(key)
+        try:
+            result = await fn()
+        except BaseException as exc:
+            self.reject(key, future, exc)
+            raise
+
+        self.resolve(key, future, result)
+        return result
+
+    def _forget(self, key: str, future: asyncio.Future) -> None:
+        if self._flights.get(key) is future:
+            del self._flights[key]
+
+    @staticmethod
+    def _consume(future: asyncio.Future) -> None:
+        # помечаем исключение как полученное, если никто не ждал результат
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import uuid
+from typing import Iterable, Optional, Set
+
+from aioredis import Redis
+from aioredis.exceptions import NoScriptError
+from aioredis.exceptions import RedisError
+
+from ..constants import RELEASE_LOCK_SCRIPT
+from ..constants import USERNAMES_BUILD_KEY
+from ..constants import USERNAMES_KEY
+from ..constants import USERNAMES_LOCK_KEY
+from ..db import users as users_db
+from ..redis.connection import state_pool
+from ..settings import settings
+
+
+# Метка в множестве: ключ есть - значит, множество построено целиком.
+# Совпадение с чьим-то именем дает лишь лишний запрос в базу.
+SENTINEL = ''
+
+# Новые имена (ARGV) добавляются только в уже построенное множество
+# (иначе появился бы "полный" ключ с одним именем) и в строящееся, если
+# идет перестроение: так имя не потеряется при RENAME.
+ADD_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('SADD', key, unpack(ARGV))
+    end
+end
+return 0
+"""
+ADD_SHA = hashlib.sha1(ADD_SCRIPT.encode()).hexdigest()
+# unpack в Lua ограничен (LUAI_MAXCSTACK): большие пачки делятся
+ADD_CHUNK_SIZE = 1000
+
+
+class UsernameFilter:
+    """Множество имен пользователей в redis.
+
+    Строится из таблицы users на старте и пополняется при регистрации.
+    Ответ "имени нет" точный, пока пользователи создаются только через
+    приложение (или bulk-загрузку); если множество не построено или redis
+    недоступен, решает база.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('main.username_filter')
+        self._rebuild_task: Optional[asyncio.Task] = None
+        # добавление не дошло до redis, и удалить множество тоже не
+        # вышло: до удаления этот воркер ему не верит
+        self._stale = False
+
+    async def contains(self, redis: Redis, username: str) -> Optional[bool]:
+        """True/False - есть ли имя; None - множество не готово."""
+        found = await self.existing(redis, (username,))
+        return None if found is None else username in found
+
+    async def existing(self,
+                       redis: Redis,
+                       usernames: Iterable[str]) -> Optional[Set[str]]:
+        """Какие из имен есть; None - множество не готово."""
+        if not settings.username_filter_enabled:
+            return None
+        usernames = list(usernames)
+
+        try:
+            if self._stale:
+                await self.invalidate(redis)
+                self._stale = False
+                self.schedule_rebuild()
+                return None
+
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.exists(USERNAMES_KEY)
+                for username in usernames:
+                    pipe.sismember(USERNAMES_KEY, username)
+                built, *found = await pipe.execute()
+        except RedisError as exc:
+            self.logger.info(f'Username filter is not checked: {exc!r}')
+            return None
+
+        if not built:
+            # например, redis перезапущен без сохранения данных
+            self.schedule_rebuild()
+            return None
+        return {username for username, member in zip(usernames, found)
+                if member}
+
+    async def add(self, redis: Redis, *usernames: str) -> bool:
+        """Вызывается после сохранения пользователей в базе.
+
+        False, если имена не дошли до redis: до перестроения множеству
+        верить нельзя.
+        """
+        if not settings.username_filter_enabled or not usernames:
+            return True
+
+        keys = (USERNAMES_KEY, USERNAMES_BUILD_KEY)
+        try:
+            for start in range(0, len(usernames), ADD_CHUNK_SIZE):
+                chunk = usernames[start:start + ADD_CHUNK_SIZE]
+                try:
+                    await redis.evalsha(ADD_SHA, len(keys), *keys, *chunk)
+                except NoScriptError:
+                    await redis.eval(ADD_SCRIPT, len(keys), *keys, *chunk)
+        except RedisError as exc:
+            self.logger.warning(f'{len(usernames)} usernames are not added '
+                                f'to the filter: {exc!r}')
+            await self._drop(redis)
+            return False
+        return True
+
+    async def _drop(self, redis: Redis) -> None:
+        # множества нет - все воркеры идут в базу, а перестроение
+        # запустит первый же contains
+        try:
+            await self.invalidate(redis)
+        except RedisError as exc:
+            self._stale = True
+            self.logger.warning(f'Username filter is not dropped: {exc!r}')
+
+    async def invalidate(self, redis: Redis) -> None:
+        """Удаляет множество: до перестроения решает база.
+
+        Строящееся тоже: иначе RENAME вернул бы множество без новых имен.
+        """
+        await redis.delete(USERNAMES_KEY, USERNAMES_BUILD_KEY)
+
+    async def rebuild(self, redis: Redis) -> bool:
+        """Строит множество заново; False, если его уже строит другой."""
+        timeout = settings.username_filter_build_timeout
+        token = uuid.uuid4().hex
+        locked = await redis.set(USERNAMES_LOCK_KEY, token,
+                                 nx=True, px=int(timeout * 1000))
+        if not locked:
+            return False
+
+        try:
+            await asyncio.wait_for(self._build(redis), timeout)
+        except Exception:
+            # старому множеству тоже нельзя верить: пусть решает база
+            await self.invalidate(redis)
+            raise
+        finally:
+            # блокировка могла истечь и достаться другому воркеру
+            await redis.eval(RELEASE_LOCK_SCRIPT, 1, USERNAMES_LOCK_KEY, token)
+        return True
+
+    async def _build(self, redis: Redis) -> None:
+        # ключ создается до чтения таблицы: имена, сохраненные после
+        # снимка курсора, add допишет сюда
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.delete(USERNAMES_BUILD_KEY)
+            pipe.sadd(USERNAMES_BUILD_KEY, SENTINEL)
+            pipe.pexpire(USERNAMES_BUILD_KEY,
+                         int(settings.username_filter_build_timeout * 1000))
+            await pipe.execute()
+
+        count = 0
+        async for batch in users_db.iter_usernames(
+                settings.username_filter_batch_size):
+            await redis.sadd(USERNAMES_BUILD_KEY, *batch)
+            count += len(batch)
+
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.rename(USERNAMES_BUILD_KEY, USERNAMES_KEY)
+            pipe.persist(USERNAMES_KEY)
+            await pipe.execute()
+        self.logger.info(f'Username filter is built: {count} names')
+
+    async def start(self) -> None:
+        if not settings.username_filter_enabled:
+            return
+        try:
+            await self.rebuild(state_pool.client())
+        except Exception as exc:
+            self.logger.warning(f'Username filter is not built: {exc!r}')
+
+    def schedule_rebuild(self) -> None:
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            return
+        self._rebuild_task = asyncio.create_task(self.start())
+
+    async def stop(self) -> None:
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+            await asyncio.gather(self._rebuild_task, return_exceptions=True)
+        self._rebuild_task = None
+
+
+username_filter = UsernameFilter()
@@ -1,21 +1,189 @@
+import os
+from typing import Dict, List, Literal, Optional
+
 from pydantic import BaseSettings
 
+from .constants import EMOTICON_SERVICE
+from .constants import LOG_DIR
+from .constants import LOG_FILE
+
 
 class Settings(BaseSettings):
     server_host: str = '0.0.0.0'
     server_port: int = 8000
+    # reload только для разработки: один процесс и слежение за файлами
+    server_reload: bool = False
+    server_workers: int = 0                     # 0 - по числу ядер
+    # os.cpu_count() в контейнере - ядра хоста, а пулы соединений
+    # открывает каждый воркер
+    server_max_workers: int = 4
+    server_loop: Literal['auto', 'asyncio', 'uvloop'] = 'auto'
+    server_http: Literal['auto', 'h11', 'httptools'] = 'auto'
+    server_backlog: int = 2048
+    server_keepalive_timeout: int = 5
+    # воркер перезапускается после стольких запросов (None - никогда)
+    server_limit_max_requests: Optional[int] = None
+    # сколько ждать незавершенные запросы после SIGTERM
+    server_graceful_timeout: int = 30
+    # адреса прокси, которым верим в X-Forwarded-For (nginx)
+    server_forwarded_allow_ips: str = '127.0.0.1'
+
+    @property
+    def workers(self) -> int:
+        if self.server_reload:
+            return 1
+        if self.server_workers:
+            return self.server_workers
+        return min(os.cpu_count() or 1, self.server_max_workers)
 
     pg_user: str
     pg_pass: str
     pg_db_name: str
     pg_host: str
     pg_port: int
+    pg_pool_min_size: int = 2
+    # None - делить pg_max_connections поровну между воркерами
+    pg_pool_max_size: Optional[int] = None
+    # все воркеры вместе; у postgres по умолчанию max_connections = 100,
+    # остаток - для bulk-загрузки, миграций и psql
+    pg_max_connections: int = 80
+    pg_command_timeout: float = 5.0
+    # размер кэша подготовленных выражений asyncpg на одно соединение
+    pg_statement_cache_size: int = 100
+
+    @property
+    def pg_pool_size(self) -> int:
+        """Соединений postgres на один воркер."""
+        if self.pg_pool_max_size:
+            return self.pg_pool_max_size
+        return max(self.pg_max_connections // self.workers, 1)
+
+    startup_backoff_initial: float = 0.5
+    startup_backoff_max: float = 10.0
+    startup_max_attempts: int = 15
+    readiness_timeout: float = 1.0
+
+    # как часто воркер переписывает вычисляемые gauge в multiprocess-режиме
+    metrics_sample_interval: float = 5.0
+    server_timing_enabled: bool = True
+    # запросы дольше порога (в секундах) логируются с разбивкой по участкам
+    slow_request_threshold: float = 1.0
+    # доля профилируемых запросов; на лету меняется ключом в redis
+    profiler_rate: float = 0.0
+    profiler_poll_interval: float = 5.0
+    profiler_dir: str = f'{LOG_DIR}/profiles'
+
+    log_level: str = 'INFO'
+    log_json: bool = False
+    # None - только stdout; {pid} в пути - отдельный файл на воркер
+    log_file: Optional[str] = LOG_FILE
+    log_rotation: Literal['size', 'time'] = 'size'
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_rotation_when: str = 'midnight'
+    log_backup_count: int = 5
+    log_queue_size: int = 10000
+    # доля сохраняемых INFO-записей частых (на каждый запрос) логгеров
+    log_sample_rate: float = 1.0
+    log_sampled_loggers: List[str] = ['main.auth_service',
+                                      'main.emoticon_services']
 
     jwt_secret: str
     jwt_algorithm: str = 'HS256'
-    jwt_expiration: int = 1000
+    # access-токен короткий: продлевается через /auth/refresh без bcrypt
+    jwt_expiration: int = 300
+    refresh_token_ttl: int = 30 * 24 * 60 * 60
+    jwt_cache_size: int = 10000
+
+    # схемы passlib: первой хэшируются новые пароли, хэши остальных схем
+    # (и с меньшим числом раундов) обновляются при входе
+    password_schemes: List[str] = ['bcrypt']
+    # подобрать под машину: python -m src.workshop.calibrate
+    password_rounds: Dict[str, int] = {'bcrypt': 12}
+    password_hash_executor: Literal['thread', 'process'] = 'thread'
+    password_hash_workers: int = 4
+    password_hash_queue_limit: int = 64
+
+    # лимиты с запасом: защищают от перебора, но не мешают людям
+    signin_rate_limit_enabled: bool = True
+    signin_username_limit: int = 30
+    signin_username_window: float = 60.0
+    signin_ip_limit: int = 300
+    signin_ip_window: float = 60.0
+    # одновременных входов на воркер, сверх - 503
+    signin_max_in_flight: int = 32
+    # множество имен в redis: вход с неизвестным именем не идет в базу
+    username_filter_enabled: bool = True
+    username_filter_batch_size: int = 1000
+    username_filter_build_timeout: float = 300.0
 
     redis_url: str
+    # refresh-токены, лимиты входа и множество имен: этот redis не должен
+    # вытеснять ключи; по умолчанию тот же, что и redis_url
+    redis_state_url: Optional[str] = None
+    redis_pool_max_size: int = 50
+    redis_pool_timeout: float = 5.0
+    redis_pool_warm_size: int = 4
+    redis_health_check_interval: int = 30
+    redis_socket_timeout: float = 5.0
+    redis_socket_connect_timeout: float = 1.0
+    redis_max_memory: Optional[str] = None      # например, 512mb
+    redis_max_memory_policy: str = 'volatile-lru'
+    redis_memory_warn_ratio: float = 0.9
+    redis_memory_report_interval: float = 60.0
+
+    @property
+    def state_redis_url(self) -> str:
+        return self.redis_state_url or self.redis_url
+
+    # в .env задается json-списком: ["http://a:8080/monster", ...]
+    emoticon_service_urls: List[str] = [EMOTICON_SERVICE]
+    emoticon_endpoint_failure_threshold: int = 3
+    emoticon_endpoint_cooldown: float = 5.0
+    # None - без хеджирования; 0.95 - второй запрос после p95 задержки
+    emoticon_hedge_percentile: Optional[float] = 0.95
+    emoticon_hedge_min_samples: int = 20
+    emoticon_latency_window: int = 200
+
+    emoticon_pool_limit: int = 100
+    emoticon_pool_limit_per_host: int = 0
+    emoticon_dns_cache_ttl: int = 300
+    emoticon_keepalive_timeout: float = 30.0
+    emoticon_connect_timeout: float = 1.0
+    emoticon_read_timeout: float = 5.0
+    emoticon_stream_chunk_size: int = 16 * 1024
+    # общий дедлайн на запрос к сервису (до первых байт при стриминге)
+    emoticon_deadline: float = 3.0
+    emoticon_negative_ttl: float = 5.0
+    emoticon_breaker_failure_threshold: int = 5
+    emoticon_breaker_reset_timeout: float = 10.0
+    emoticon_breaker_half_open_max_calls: int = 1
+
+    emoticon_cache_max_age: int = 86400
+    # после soft_ttl картинка отдается, но обновляется в фоне,
+    # после hard_ttl redis ее удаляет; 0 - без ограничения
+    emoticon_soft_ttl: int = 7 * 24 * 3600
+    emoticon_hard_ttl: int = 30 * 24 * 3600
+    emoticon_refresh_concurrency: int = 16
+    # /emoticon/ требует токен: общие кэши не должны отдавать картинку
+    # без авторизации
+    emoticon_cache_public: bool = False
+
+    emoticon_batch_max_size: int = 100
+    emoticon_batch_concurrency: int = 8
+    # self - только своя картинка, any - любого пользователя
+    emoticon_batch_policy: Literal['self', 'any'] = 'self'
+
+    emoticon_l1_max_bytes: int = 32 * 1024 * 1024
+    emoticon_l1_ttl: float = 60.0
+    emoticon_l1_stale_ttl: float = 300.0
+
+    emoticon_prefetch_enabled: bool = True
+    emoticon_prefetch_queue_size: int = 1000
+    emoticon_prefetch_workers: int = 2
+
+    emoticon_lock_ttl: float = 10.0
+    emoticon_lock_wait: float = 10.0
+    emoticon_lock_poll_interval: float = 0.05
 
 
 settings = Settings(
@@ -0,0 +1,52 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+
+# длительность именованных участков текущего запроса; словарь создает
+# TimingMiddleware, вне запроса (фоновые задачи на старте) его нет
+_spans: ContextVar[Optional[Dict[str, float]]] = ContextVar('spans',
+                                                            default=None)
+# участки, по которым видно, например, есть ли пользователь, клиенту
+# не отдаются (остаются в логе медленных запросов)
+_hidden: ContextVar[bool] = ContextVar('spans_hidden', default=False)
+
+
+def start_request() -> Dict[str, float]:
+    spans: Dict[str, float] = {}
+    _spans.set(spans)
+    _hidden.set(False)
+    return spans
+
+
+def hide_spans() -> None:
+    """В Server-Timing текущего запроса будет только total."""
+    _hidden.set(True)
+
+
+def spans_hidden() -> bool:
+    return _hidden.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Добавляет время блока к участку name (повторы суммируются)."""
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        spans[name] = spans.get(name, 0.0) + elapsed
+
+
+def server_timing(spans: Dict[str, float], total: float) -> str:
+    parts = [f'{name};dur={elapsed * 1000:.2f}'
+             for name, elapsed in spans.items()]
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
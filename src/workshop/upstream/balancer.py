@@ -0,0 +1,224 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Collection, Deque, List, Optional
+
+from aiohttp import ClientResponse
+from aiohttp import ClientSession
+
+from ..settings import settings
+from ..metrics import UPSTREAM_ENDPOINT_DOWN
+from ..metrics import UPSTREAM_EXTRA_REQUESTS
+from ..metrics import UPSTREAM_EXTRA_WINS
+from ..metrics import UPSTREAM_OUTSTANDING
+from ..metrics import track
+
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        self.failures = 0
+        self.down_until = 0.0
+        track(UPSTREAM_OUTSTANDING.labels(endpoint=self.url),
+              lambda: self.outstanding)
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+
+class Balancer:
+    """Выбирает реплику сервиса с наименьшим числом запросов в работе.
+
+    Здоровье реплик проверяется пассивно: после failure_threshold ошибок
+    подряд реплика исключается на cooldown секунд. Если первая реплика
+    отвечает дольше hedge_percentile недавних ответов (или сразу ответила
+    ошибкой), тот же запрос отправляется во вторую и берется первый
+    успешный ответ.
+    """
+
+    def __init__(self,
+                 urls: List[str],
+                 failure_threshold: int,
+                 cooldown: float,
+                 hedge_percentile: Optional[float],
+                 hedge_min_samples: int,
+                 latency_window: int):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+
+    def pick(self, exclude: Collection[Endpoint] = ()) -> Optional[Endpoint]:
+        candidates = [endpoint for endpoint in self.endpoints
+                      if endpoint not in exclude]
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in candidates
+                   if endpoint.is_healthy(now)]
+        # если здоровых нет, пробуем хоть какую-то реплику;
+        # при равной загрузке выбираем случайно, чтобы не греть первую
+        return min(healthy or candidates,
+                   key=lambda e: (e.outstanding, random.random()))
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_percentile or len(self.endpoints) < 2:
+            return None
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+
+        latencies = sorted(self._latencies)
+        index = min(int(len(latencies) * self.hedge_percentile),
+                    len(latencies) - 1)
+        return latencies[index]
+
+    def record(self, endpoint: Endpoint, ok: bool, latency: float) -> None:
+        if ok:
+            endpoint.failures = 0
+            self._latencies.append(latency)
+            return
+
+        endpoint.failures += 1
+        if endpoint.failures >= self.failure_threshold:
+            endpoint.down_until = time.monotonic() + self.cooldown
+            endpoint.failures = 0
+            UPSTREAM_ENDPOINT_DOWN.labels(endpoint=endpoint.url).inc()
+
+    async def _get(self,
+                   http: ClientSession,
+                   endpoint: Endpoint,
+                   path: str) -> ClientResponse:
+        endpoint.outstanding += 1
+        started = time.monotonic()
+        try:
+            response = await http.get(f'{endpoint.url}/{path}')
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.record(endpoint, False, time.monotonic() - started)
+            raise
+        finally:
+            endpoint.outstanding -= 1
+
+        self.record(endpoint, response.status == 200,
+                    time.monotonic() - started)
+        return response
+
+    async def get(self,
+                  http: ClientSession,
+                  path: str,
+                  timeout: float) -> ClientResponse:
+        """GET к одной из реплик (с хеджированием), не дольше timeout.
+
+        Возвращает первый ответ со статусом 200; если таких нет - первый
+        полученный ответ. Если ответов нет совсем, пробрасывает ошибку
+        последнего запроса или asyncio.TimeoutError.
+        """
+        deadline = time.monotonic() + timeout
+        primary = self.pick()
+        tasks = [asyncio.create_task(self._get(http, primary, path))]
+
+        try:
+            delay = self.hedge_delay()
+            if delay is None or delay >= timeout:
+                delay = timeout
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+
+            secondary = None
+            if not done or not self._succeeded(tasks[0]):
+                secondary = self.pick(exclude=(primary,))
+            if secondary is not None and time.monotonic() < deadline:
+                reason = 'failover' if done else 'hedge'
+                UPSTREAM_EXTRA_REQUESTS.labels(reason=reason).inc()
+                tasks.append(asyncio.create_task(
+                    self._get(http, secondary, path),
+                ))
+
+            response = await self._first(tasks, deadline)
+            if len(tasks) > 1 and self._succeeded(tasks[1]) and \
+                    tasks[1].result() is response:
+                UPSTREAM_EXTRA_WINS.inc()
+            return response
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _succeeded(task: asyncio.Task) -> bool:
+        return task.done() and not task.cancelled() and \
+            task.exception() is None and task.result().status == 200
+
+    @staticmethod
+    async def _first(tasks: List[asyncio.Task],
+                     deadline: float) -> ClientResponse:
+        pending = set(tasks)
+        fallback = None
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=max(deadline - time.monotonic(), 0),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                break
+
+            responses = []
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                else:
+                    responses.append(task.result())
+
+            # запросы могут завершиться одновременно: лишние ответы
+            # освобождаются, иначе соединение не вернется в пул
+            winner = next((response for response in responses
+                           if response.status == 200), None)
+            if winner is not None:
+                for response in responses:
+                    if response is not winner:
+                        response.release()
+                if fallback is not None:
+                    fallback.release()
+                Balancer._release_rest(pending)
+                return winner
+
+            for response in responses:
+                if fallback is None:
+                    fallback = response
+                else:
+                    response.release()
+
+        Balancer._release_rest(pending)
+        if fallback is not None:
+            return fallback
+        if error is not None and not pending:
+            raise error
+        raise asyncio.TimeoutError()
+
+    @staticmethod
+    def _release_rest(tasks: Collection[asyncio.Task]) -> None:
+        # ответы проигравших запросов, которые успеют прийти, не нужны
+        for task in tasks:
+            task.cancel()
+            task.add_done_callback(Balancer._release_result)
+
+    @staticmethod
+    def _release_result(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is None:
+            task.result().release()
+
+
+emoticon_balancer = Balancer(
+    urls=settings.emoticon_service_urls,
+    failure_threshold=settings.emoticon_endpoint_failure_threshold,
+    cooldown=settings.emoticon_endpoint_cooldown,
+    hedge_percentile=settings.emoticon_hedge_percentile,
+    hedge_min_samples=settings.emoticon_hedge_min_samples,
+    latency_window=settings.emoticon_latency_window,
+)
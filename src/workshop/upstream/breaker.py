@@ -0,0 +1,89 @@
+import time
+
+from ..settings import settings
+from ..metrics import UPSTREAM_BREAKER_STATE
+from ..metrics import UPSTREAM_BREAKER_TRANSITIONS
+
+
+class CircuitBreaker:
+    """Размыкается после failure_threshold ошибок подряд.
+
+    В разомкнутом состоянии запросы не пропускаются reset_timeout секунд,
+    затем пропускается не больше half_open_max_calls пробных запросов:
+    успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self,
+                 name: str,
+                 failure_threshold: int,
+                 reset_timeout: float,
+                 half_open_max_calls: int):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self._failures = 0
+        self._changed_at = time.monotonic()
+        self._probes = 0
+        self._set_state(self.CLOSED)
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+
+        if self.state == self.OPEN:
+            if now - self._changed_at < self.reset_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+
+        if self.state == self.HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                # пробный запрос так и не завершился - пробуем еще раз
+                if now - self._changed_at < self.reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            self._probes += 1
+
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == self.HALF_OPEN or \
+                self._failures >= self.failure_threshold:
+            self._set_state(self.OPEN)
+
+    def reset(self) -> None:
+        """Замыкает цепь и забывает ошибки (например, между тестами)."""
+        self._failures = 0
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            UPSTREAM_BREAKER_TRANSITIONS.labels(
+                breaker=self.name, state=state,
+            ).inc()
+        for known in (self.CLOSED, self.OPEN, self.HALF_OPEN):
+            UPSTREAM_BREAKER_STATE.labels(
+                breaker=self.name, state=known,
+            ).set(int(known == state))
+
+        self.state = state
+        self._changed_at = time.monotonic()
+        self._probes = 0
+
+
+emoticon_breaker = CircuitBreaker(
+    name='emoticon',
+    failure_threshold=settings.emoticon_breaker_failure_threshold,
+    reset_timeout=settings.emoticon_breaker_reset_timeout,
+    half_open_max_calls=settings.emoticon_breaker_half_open_max_calls,
+)
@@ -0,0 +1,55 @@
+from typing import Optional
+
+from aiohttp import ClientSession
+from aiohttp import ClientTimeout
+from aiohttp import TCPConnector
+
+from ..settings import settings
+
+
+class HTTPClient:
+    """Долгоживущая aiohttp-сессия к сервису эмотиконов (одна на воркер)."""
+
+    def __init__(self):
+        self._session: Optional[ClientSession] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._session is not None and not self._session.closed
+
+    @property
+    def session(self) -> ClientSession:
+        if not self.is_connected:
+            raise RuntimeError('HTTP client is not connected')
+        return self._session
+
+    async def connect(self) -> None:
+        if self.is_connected:
+            return
+
+        connector = TCPConnector(
+            limit=settings.emoticon_pool_limit,
+            limit_per_host=settings.emoticon_pool_limit_per_host,
+            ttl_dns_cache=settings.emoticon_dns_cache_ttl,
+            keepalive_timeout=settings.emoticon_keepalive_timeout,
+        )
+        timeout = ClientTimeout(
+            connect=settings.emoticon_connect_timeout,
+            sock_read=settings.emoticon_read_timeout,
+        )
+        self._session = ClientSession(connector=connector, timeout=timeout)
+
+    async def disconnect(self) -> None:
+        if self.is_connected:
+            await self._session.close()
+        self._session = None
+
+
+http_client = HTTPClient()
+
+
+async def get_session() -> ClientSession:
+    # вне жизненного цикла приложения (например, в тестах) подключаемся лениво
+    if not http_client.is_connected:
+        await http_client.connect()
+    return http_client.session
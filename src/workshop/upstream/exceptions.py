@@ -0,0 +1,6 @@
+class UpstreamError(Exception):
+    """Сервис эмотиконов не вернул корректную картинку."""
+
+
+class CircuitOpenError(UpstreamError):
+    """Сервис недавно отказывал, запрос к нему не отправлялся."""